@@ -1,15 +1,44 @@
 from flask import Flask, request
 from linebot import LineBotApi
-from linebot.models import FlexSendMessage, TextSendMessage, QuickReply, QuickReplyButton, MessageAction
-from sentence_transformers import SentenceTransformer, util
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error, TextSendMessage, QuickReply, QuickReplyButton, MessageAction
+from sentence_transformers import SentenceTransformer
 from neo4j import GraphDatabase  # สำหรับเชื่อมต่อกับ Neo4j
+import atexit
+import contextlib
+import functools
+import gc
+import hashlib
 import json
+import logging
+import os
+import queue
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import zlib
+try:
+    import fcntl  # POSIX only; without it every process runs its own catalog crawler
+except ImportError:
+    fcntl = None
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
+import torch
 from selenium import webdriver
 import chromedriver_autoinstaller
 from bs4 import BeautifulSoup
+import extract
+from extract import Product
 from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
 import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -20,62 +49,751 @@ chrome_options.add_argument('--headless')  # Run in headless mode
 chrome_options.add_argument('--no-sandbox')
 chrome_options.add_argument('--disable-dev-shm-usage')
 chrome_options.add_argument('--disable-gpu')
-chromedriver_autoinstaller.install()
 
-# Initialize SentenceTransformer model
-model = SentenceTransformer('sentence-transformers/distiluse-base-multilingual-cased-v2')
+# Scraping settings
+BASE_URL = os.environ.get("SCRAPE_BASE_URL", "https://mustardsneakers.com")  # Point at fixture_server.py for offline runs
+FETCH_BACKEND = os.environ.get("SCRAPE_BACKEND", "http")  # "http" (Selenium only as fallback) or "selenium"
+HTTP_POOL_SIZE = 10  # Keep-alive connections kept open to the shop
+HTTP_TIMEOUT = 10  # Seconds per HTTP request
+HTTP_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+# Search result cache settings
+SEARCH_CACHE_BACKEND = os.environ.get("SEARCH_CACHE_BACKEND", "memory")  # "memory" (per process) or "sqlite" (shared)
+SEARCH_CACHE_PATH = "cache/search.sqlite3"  # Database file for the shared sqlite backend
+SEARCH_CACHE_SIZE = 512  # Maximum number of cached search terms (least recently used are evicted)
+SEARCH_CACHE_TTL = 600  # Seconds a search result is served without refreshing
+SEARCH_CACHE_STALE = 1800  # Further seconds a stale result is served while it refreshes in the background
+SEARCH_CACHE_EMPTY_TTL = 60  # Shorter TTL for searches that found nothing
+
+# Catalog crawler settings
+CATALOG_DB_PATH = "cache/catalog.sqlite3"  # Local product catalog with its full-text index
+CATALOG_COLLECTIONS = ["all"]  # Collections to crawl when /collections.json is unavailable
+CATALOG_CRAWL_INTERVAL = 6 * 3600  # Seconds between re-crawls (0 disables the background crawler)
+CATALOG_SYNC_INTERVAL = 300  # Seconds between catalog re-reads in worker processes that do not crawl
+CATALOG_CRAWL_CONCURRENCY = 4  # Parallel page fetches while crawling
+CATALOG_MAX_PAGES = 20  # Maximum pages walked per collection
+CATALOG_SEARCH_LIMIT = 12  # Products returned per catalog search (a Flex carousel holds 12 bubbles)
+PRODUCT_MATCH_THRESHOLD = 0.35  # Minimum cosine similarity for a semantic product match
+PRODUCT_INDEX_DTYPE = np.float16  # Product embeddings are stored as float16 to keep the array compact
+
+# Flex message settings
+FLEX_MAX_BUBBLES = 12  # LINE rejects carousels with more bubbles
+FLEX_CACHE_SIZE = 256  # Rendered carousels kept, keyed by their product set
+
+# Webhook event worker settings
+EVENT_WORKERS = 8  # Worker threads handling LINE events
+EVENT_QUEUE_SIZE = 100  # Pending events per worker before the webhook starts rejecting
+EVENT_ENQUEUE_TIMEOUT = 0.5  # Seconds the webhook waits for queue space
+EVENT_DEDUP_SIZE = 10000  # Recent webhookEventIds remembered to drop redeliveries
+EVENT_LATENCY_WINDOW = 1000  # Recent events kept for the latency summary
+EVENT_DRAIN_TIMEOUT = 30  # Seconds to finish queued events on shutdown
+
+# Chat history writer settings
+HISTORY_BATCH_SIZE = 200  # Maximum records per UNWIND write
+HISTORY_FLUSH_INTERVAL = 1.0  # Seconds a partial batch waits before it is written
+HISTORY_BUFFER_SIZE = 10000  # Records buffered in memory before HISTORY_WHEN_FULL applies
+HISTORY_WHEN_FULL = "drop"  # "drop" new records or "block" the caller when the buffer is full
+HISTORY_BLOCK_TIMEOUT = 5  # Seconds a "block" caller waits for buffer space before the record is dropped
+HISTORY_MAX_RETRIES = 5  # Retries for a failed batch (exponential backoff)
+HISTORY_RETRY_BACKOFF = 0.5  # Seconds before the first retry
+HISTORY_DRAIN_TIMEOUT = 30  # Seconds to flush buffered records on shutdown
+CHAT_RETENTION_DAYS = int(os.environ.get("CHAT_RETENTION_DAYS", 90))  # Chat nodes older than this are rolled into daily summaries
+CHAT_RETENTION_INTERVAL = int(os.environ.get("CHAT_RETENTION_INTERVAL", 24 * 3600))  # Seconds between retention runs (0 disables)
+CHAT_RETENTION_START_DELAY = 300  # First run this long after startup, so restarts more often than daily still run it
+CHAT_RETENTION_BATCH = 1000  # Chat nodes summarized and deleted per transaction
+CHAT_RETENTION_MAX_BATCHES = 200  # Batches per run; the rest waits for the next run
+CHAT_SUMMARY_TIMEZONE = "Asia/Bangkok"  # Time zone that decides which day a chat belongs to
+
+# Metrics and tracing settings
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Histogram buckets in seconds
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"  # Log one JSON line per handled event with its stage timings
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))  # Log hot stacks of events slower than this (0 disables)
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples while profiling
+PROFILE_TOP_STACKS = 10  # Stacks logged per slow event
+
+# Browser pool settings
+BROWSER_POOL_SIZE = 2  # Maximum number of concurrent headless Chrome sessions
+BROWSER_MAX_PAGES = 50  # Recycle a session after it has loaded this many pages
+BROWSER_CHECKOUT_TIMEOUT = 20  # Seconds to wait for a free session before giving up
+
+# Startup settings
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "0") == "1"  # Run one dummy encode and scrape before reporting ready
+STARTUP_RETRY_INTERVAL = 5  # Seconds between attempts to initialize a component whose dependency is down
+
+logger = logging.getLogger("WebScape")
+
+# gunicorn only configures its own loggers, so without a handler every INFO line (startup, preload,
+# TRACE_LOG traces) would be dropped. Logging set up elsewhere (basicConfig, --log-config) is kept.
+def configure_logging():
+    if logging.getLogger().handlers or logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+# A process-wide dependency (model, database driver, ...) created on first use or in the background
+# by init_components. Creation time is logged, and a failed creation is retried on the next use,
+# so a dependency being down does not stop the process from starting.
+class Component:
+    def __init__(self, name, factory, required=True):
+        self.name = name
+        self.factory = factory
+        self.required = required  # Required components must be ready before /readyz reports ready
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._starting = False
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self):
+        if self._ready.is_set():
+            return self.value
+        with self._lock:
+            if not self._ready.is_set():
+                started = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = repr(e)
+                    raise
+                self.seconds = time.perf_counter() - started
+                self.error = None
+                self._ready.set()
+                logger.info("Startup: %s ready in %.2fs", self.name, self.seconds)
+        return self.value
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    # Initialize in a background thread, retrying until it succeeds
+    def start(self):
+        with self._lock:
+            if self._starting:
+                return
+            self._starting = True
+
+        def run():
+            while True:
+                try:
+                    self.get()
+                    return
+                except Exception as e:
+                    logger.warning("Startup: %s failed (%s), retrying in %ss", self.name, e, STARTUP_RETRY_INTERVAL)
+                    time.sleep(STARTUP_RETRY_INTERVAL)
+        threading.Thread(target=run, name=f"init-{self.name}", daemon=True).start()
+
+    def status(self):
+        return {"ready": self.ready, "required": self.required,
+                "seconds": round(self.seconds, 3) if self.seconds is not None else None, "error": self.error}
+
+components = {}
+
+def component(name, factory, required=True):
+    components[name] = Component(name, factory, required)
+    return components[name]
+
+# Call fn every `interval` seconds on a daemon thread named `name`; a failure is logged and the next
+# run happens on schedule. Returns an event that stops the loop when set.
+def run_periodically(name, interval, fn, first_delay=None):
+    def loop():
+        delay = interval if first_delay is None else first_delay
+        while not stop.wait(delay):
+            delay = interval
+            try:
+                fn()
+            except Exception as e:
+                logger.warning("%s failed: %s", name, e)
+    stop = threading.Event()
+    threading.Thread(target=loop, name=name, daemon=True).start()
+    return stop
+
+# Prometheus-style metrics kept in process: latency histograms and counters, with labels
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._help = {}
+        self._histograms = {}  # name -> {label items: [bucket counts..., sum, count]}
+        self._counters = {}  # name -> {label items: value}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = self._histograms[name][key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    # Text exposition format; `gauges` adds point-in-time values as {name: {label items: value}}
+    def render(self, gauges=None):
+        def labels_text(items, extra=()):
+            items = list(items) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        for name, series in sorted(histograms.items()):
+            lines += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} histogram"]
+            for key, values in sorted(series.items()):
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f"{name}_bucket{labels_text(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{labels_text(key, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{labels_text(key)} {values[-2]:.6f}")
+                lines.append(f"{name}_count{labels_text(key)} {values[-1]}")
+        for kind, families in (("counter", counters), ("gauge", gauges or {})):
+            for name, series in sorted(families.items()):
+                lines += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} {kind}"]
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{labels_text(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("stage_duration_seconds", "Time spent in each stage (fetch, parse, encode, Neo4j, LINE reply, ...)")
+metrics.describe("event_duration_seconds", "Time to handle one LINE event, by the routing tier that resolved it")
+metrics.describe("event_queue_wait_seconds", "Time a LINE event waited in the worker queue")
+metrics.describe("events_total", "LINE events handled, by outcome")
+
+# Spans recorded on the current thread while it handles an event (see trace_event)
+_trace = threading.local()
+
+# Time a stage: feeds the stage histogram and, inside trace_event, the per-event trace
+@contextlib.contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("stage_duration_seconds", elapsed, stage=stage)
+        spans = getattr(_trace, "spans", None)
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+def traced(stage):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Opt-in sampling profiler: while an event is being handled its thread's stack is sampled every
+# PROFILE_INTERVAL seconds, and the hottest stacks are logged (folded, flamegraph-ready) when the
+# event turns out slower than PROFILE_SLOW_MS.
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, interval=PROFILE_INTERVAL):
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self._active = {}  # thread id -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def begin(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, duration_ms, label):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and duration_ms >= self.threshold_ms:
+            total = sum(samples.values())
+            hot = "\n".join(f"  {count}/{total} {stack}" for stack, count in samples.most_common(PROFILE_TOP_STACKS))
+            logger.warning("Slow event (%s) took %.0fms; hot stacks:\n%s", label, duration_ms, hot)
+
+    @staticmethod
+    def _fold(frame):
+        stack = []
+        while frame is not None and len(stack) < 64:
+            stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self._fold(frame)] += 1
+
+profiler = SlowRequestProfiler()
+
+# Trace one event: collects the spans recorded while it runs, then observes its total duration,
+# logs a structured line (TRACE_LOG) and hands it to the slow-request profiler
+@contextlib.contextmanager
+def trace_event(event_id):
+    _trace.spans = []
+    _trace.intent = "none"
+    outcome = "error"
+    if profiler.enabled:
+        profiler.begin()
+    started = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        spans, intent = _trace.spans, _trace.intent
+        _trace.spans = None
+        metrics.observe("event_duration_seconds", elapsed, intent=intent)
+        metrics.inc("events_total", outcome=outcome)
+        if profiler.enabled:
+            profiler.end(elapsed * 1000, f"{intent} {event_id}")
+        if TRACE_LOG:
+            stages = {}
+            for stage, seconds in spans:
+                stages[stage] = round(stages.get(stage, 0) + seconds * 1000, 2)
+            logger.info(json.dumps({"event": event_id, "intent": intent, "outcome": outcome,
+                                    "total_ms": round(elapsed * 1000, 2), "stages_ms": stages}))
+
+# Sentence encoder settings
+MODEL_NAME = os.environ.get("MODEL_NAME", 'sentence-transformers/distiluse-base-multilingual-cased-v2')  # Hub id or a local copy
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")  # "torch" (fp32), "int8" (dynamically quantized torch) or "onnx"
+ENCODER_THREADS = int(os.environ.get("ENCODER_THREADS", "0"))  # CPU threads used for inference (0 = library default)
+ENCODER_ONNX_FILE = os.environ.get("ENCODER_ONNX_FILE")  # e.g. "onnx/model_qint8_avx512_vnni.onnx"; default exports fp32 ONNX
+
+# Identifies the vectors an encoder produces; indexes built by another backend are not reused
+def encoder_id(backend=ENCODER_BACKEND, onnx_file=ENCODER_ONNX_FILE):
+    return f"{MODEL_NAME}:{backend}" + (f":{onnx_file}" if backend == "onnx" and onnx_file else "")
+
+# Loads the SentenceTransformer model on one of the CPU inference backends and encodes
+# normalized embeddings. Every embedding caller goes through this class.
+class SentenceEncoder:
+    def __init__(self, backend=ENCODER_BACKEND, threads=ENCODER_THREADS, onnx_file=ENCODER_ONNX_FILE):
+        self.backend = backend
+        self.id = encoder_id(backend, onnx_file)
+        if threads:
+            torch.set_num_threads(threads)
+        if backend == "onnx":
+            import onnxruntime  # Optional dependency, only needed for this backend
+            session_options = onnxruntime.SessionOptions()
+            if threads:
+                session_options.intra_op_num_threads = threads
+            model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+            if onnx_file:
+                model_kwargs["file_name"] = onnx_file
+            self.model = SentenceTransformer(MODEL_NAME, backend="onnx", model_kwargs=model_kwargs)
+        elif backend == "int8":
+            # Linear layers run as int8 matmuls; the rest of the network stays fp32
+            self.model = torch.quantization.quantize_dynamic(SentenceTransformer(MODEL_NAME), {torch.nn.Linear},
+                                                             dtype=torch.qint8)
+        elif backend == "torch":
+            self.model = SentenceTransformer(MODEL_NAME)
+        else:
+            raise ValueError(f"Unknown encoder backend {backend!r}")
+        self.model.eval()
+
+    # One text -> vector, a list of texts -> matrix (rows are L2-normalized float32)
+    def encode(self, texts, batch_size=32):
+        with span("encode"), torch.inference_mode():
+            return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+model_component = component("model", SentenceEncoder)
+
+def get_encoder():
+    return model_component.get()
+
+# chromedriver matching the installed Chrome; only the Selenium backend needs it
+chromedriver_component = component("chromedriver", chromedriver_autoinstaller.install, required=False)
+
+# Embedding index settings
+INDEX_DIR = "index"  # Directory holding the precomputed embedding matrices
+INDEX_DTYPE = np.float32  # np.float16 halves disk and RAM at a small cost in score precision
+INDEX_BATCH_SIZE = 64  # Number of texts per model.encode call when (re)building an index
+GREETING_THRESHOLD = 0.5  # Minimum cosine similarity for a greeting match
+GREETING_REFRESH_INTERVAL = 300  # Seconds between reloads of Greeting names and replies from Neo4j
+QUERY_CACHE_SIZE = 2048  # User-message embeddings (and their greeting match) kept in the LRU cache
+ENCODE_BATCH_WINDOW = 0.0  # Seconds to gather concurrent messages into one encode call (0 disables micro-batching)
+ENCODE_MAX_BATCH = 32  # Largest micro-batch
+
+# FAQ settings
+FAQ_REFRESH_INTERVAL = int(os.environ.get("FAQ_REFRESH_INTERVAL", 3600))  # Seconds between re-reads of the FAQ page
+FAQ_THRESHOLD = 0.6  # Minimum cosine similarity for answering a free-text question from the FAQ
+# Questions offered in the "General" menu, answered when the user taps 1-4
+FAQ_MENU = {
+    "1": "ลองสินค้าจริงได้ที่ไหนบ้าง",
+    "2": "Mustard Sneakers เป็นแบรนด์ของที่ไหน",
+    "3": "รองเท้าทำมาจากวัสดุอะไร",
+    "4": "ทำความสะอาดรองเท้าอย่างไร",
+}
 
 # Neo4j connection setup
 NEO4J_URI = "bolt://localhost:7687"  # Your Neo4j URI
 NEO4J_USER = "neo4j"  # Your Neo4j username
 NEO4J_PASSWORD = "password"  # Your Neo4j password
 
-# Initialize Neo4j driver
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+# Initialize Neo4j driver (connectivity is checked so readiness reflects a reachable database)
+def connect_neo4j():
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    driver.verify_connectivity()
+    return driver
+
+neo4j_component = component("neo4j", connect_neo4j)
+
+def get_driver():
+    return neo4j_component.get()
 
 app = Flask(__name__)
 
+# LineBotApi whose replies are timed as the "line_reply" stage
+class TracedLineBotApi(LineBotApi):
+    def reply_message(self, *args, **kwargs):
+        with span("line_reply"):
+            return super().reply_message(*args, **kwargs)
+
+    # Reply with messages that are already serialized to JSON, without building SDK message objects.
+    # Posts through the public http_client/headers/endpoint attributes rather than the SDK-private
+    # _post, and raises LineBotApiError on an error response the same way reply_message does.
+    def reply_json(self, reply_token, messages, timeout=None):
+        body = '{"replyToken":%s,"messages":[%s]}' % (json.dumps(reply_token), ",".join(messages))
+        headers = dict(self.headers, **{'Content-Type': 'application/json'})
+        with span("line_reply"):
+            response = self.http_client.post(self.endpoint + '/v2/bot/message/reply', headers=headers,
+                                             data=body.encode("utf-8"), timeout=timeout)
+        if not 200 <= response.status_code < 300:
+            raise LineBotApiError(status_code=response.status_code, headers=dict(response.headers.items()),
+                                  request_id=response.headers.get('X-Line-Request-Id'),
+                                  error=Error.new_from_json_dict(response.json))
+
 # Initialize LineBotApi with your channel access token
-line_bot_api = LineBotApi('access_token')
+LINE_API_ENDPOINT = os.environ.get("LINE_API_ENDPOINT", "https://api.line.me")  # Point at a stand-in for load tests
+line_bot_api = TracedLineBotApi('access_token', endpoint=LINE_API_ENDPOINT)
 
 # Function to run Neo4j queries
+@traced("neo4j_query")
 def run_query(query, parameters=None):
-    with driver.session() as session:
+    with get_driver().session() as session:
         result = session.run(query, parameters)
         return [record for record in result]
 
-# Fetching the greeting corpus from Neo4j
-cypher_query = '''
-MATCH (n:Greeting) RETURN n.name as name, n.msg_reply as reply;
-'''
-greeting_corpus = []
-results = run_query(cypher_query)
-for record in results:
-    greeting_corpus.append(record['name'])
-greeting_corpus = list(set(greeting_corpus))
+# Memory-mapped matrix of normalized sentence embeddings, persisted on disk and keyed by a corpus hash.
+# Rebuilding only encodes texts that are not in the previous matrix, so adding or removing a few
+# items costs a few encodes instead of re-encoding the whole corpus.
+class EmbeddingIndex:
+    def __init__(self, name, directory=INDEX_DIR, dtype=INDEX_DTYPE):
+        self.name = name
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.corpus_hash = None
+        # keys, texts and matrix are swapped together so readers never see a half-built index
+        self._state = ([], [], np.zeros((0, 0), dtype=self.dtype))
+        self._build_lock = threading.Lock()
+
+    @property
+    def keys(self):
+        return self._state[0]
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def _hash(self, keys, texts):
+        digest = hashlib.sha256()
+        digest.update(f"{encoder_id()}|{self.dtype.name}".encode("utf-8"))
+        for key, text in zip(keys, texts):
+            digest.update(b"\0" + key.encode("utf-8") + b"\1" + text.encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def _paths(self, corpus_hash):
+        base = os.path.join(self.directory, f"{self.name}-{corpus_hash}")
+        return base + ".npy", base + ".json"
+
+    def _load(self, corpus_hash):
+        matrix_path, meta_path = self._paths(corpus_hash)
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("encoder") != encoder_id():
+            return None
+        matrix = np.load(matrix_path, mmap_mode="r")
+        if matrix.shape[0] != len(meta["keys"]):
+            return None
+        return meta["keys"], meta["texts"], matrix
+
+    def _latest_on_disk(self):
+        # Previous index files for this name, used to seed an incremental rebuild after a restart
+        if not os.path.isdir(self.directory):
+            return None
+        candidates = [f for f in os.listdir(self.directory) if f.startswith(self.name + "-") and f.endswith(".json")]
+        candidates.sort(key=lambda f: os.path.getmtime(os.path.join(self.directory, f)), reverse=True)
+        for filename in candidates:
+            loaded = self._load(filename[len(self.name) + 1:-len(".json")])
+            if loaded is not None:
+                return loaded
+        return None
+
+    # Adopt the newest index on disk without encoding anything, e.g. in a pre-fork master process
+    def load_latest(self):
+        loaded = self._latest_on_disk()
+        if loaded is None:
+            return False
+        with self._build_lock:
+            if self.corpus_hash is None:
+                self._state = loaded
+                self.corpus_hash = self._hash(loaded[0], loaded[1])
+        return True
+
+    def _remove_stale(self, keep_hash):
+        for filename in os.listdir(self.directory):
+            if filename.startswith(self.name + "-") and not filename.startswith(f"{self.name}-{keep_hash}."):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    # Build (or load) the index for the given keys and the texts to embed for each key.
+    # Returns True when the index changed.
+    def build(self, keys, texts=None):
+        texts = list(keys) if texts is None else list(texts)
+        pairs = sorted(dict(zip(keys, texts)).items())
+        keys = [key for key, _ in pairs]
+        texts = [text for _, text in pairs]
+        corpus_hash = self._hash(keys, texts)
+        with self._build_lock:
+            if corpus_hash == self.corpus_hash:
+                return False
+            loaded = self._load(corpus_hash)
+            if loaded is None:
+                loaded = self._rebuild(corpus_hash, keys, texts)
+            self._state = loaded
+            self.corpus_hash = corpus_hash
+            logger.info("%s index ready: %d items (hash %s)", self.name, len(keys), corpus_hash)
+            return True
+
+    def _rebuild(self, corpus_hash, keys, texts):
+        previous = self._state if len(self._state[0]) else self._latest_on_disk()
+        reuse = {}
+        if previous is not None:
+            prev_keys, prev_texts, prev_matrix = previous
+            for row, (key, text) in enumerate(zip(prev_keys, prev_texts)):
+                reuse[(key, text)] = prev_matrix[row]
+
+        missing = [i for i, pair in enumerate(zip(keys, texts)) if pair not in reuse]
+        encoded = {}
+        if missing:
+            vectors = get_encoder().encode([texts[i] for i in missing], batch_size=INDEX_BATCH_SIZE)
+            encoded = dict(zip(missing, vectors))
+        logger.info("%s index: reused %d vectors, encoded %d", self.name, len(keys) - len(missing), len(missing))
+
+        if not keys:
+            matrix = np.zeros((0, 0), dtype=self.dtype)
+        else:
+            rows = [encoded[i] if i in encoded else reuse[(keys[i], texts[i])] for i in range(len(keys))]
+            matrix = np.asarray(rows, dtype=self.dtype)
+
+        os.makedirs(self.directory, exist_ok=True)
+        matrix_path, meta_path = self._paths(corpus_hash)
+        # Write to temporary files first so a crash never leaves a truncated index behind
+        # (named per process, as several workers may build the same index at once)
+        tmp = f".{os.getpid()}.tmp"
+        np.save(matrix_path + tmp + ".npy", matrix)
+        os.replace(matrix_path + tmp + ".npy", matrix_path)
+        with open(meta_path + tmp, "w", encoding="utf-8") as f:
+            json.dump({"encoder": encoder_id(), "keys": keys, "texts": texts}, f, ensure_ascii=False)
+        os.replace(meta_path + tmp, meta_path)
+        self._remove_stale(corpus_hash)
+        return keys, texts, np.load(matrix_path, mmap_mode="r")
+
+    # Top-k cosine search for one normalized query vector with a single matmul
+    def search(self, query_vec, k=1):
+        keys, _, matrix = self._state
+        if not keys:
+            return []
+        scores = matrix @ np.asarray(query_vec, dtype=np.float32)  # float16 matrices are scored in float32
+        k = min(k, len(keys))
+        if k == 1:
+            top = [int(np.argmax(scores))]
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        return [(keys[i], float(scores[i])) for i in top]
+
+greeting_index = EmbeddingIndex("greetings")
+
+# In-memory greeting knowledge: name -> replies, loaded together with the greeting embedding index
+# so a greeting match is answered without a database round trip.
+class GreetingKnowledge:
+    query = "MATCH (n:Greeting) WHERE n.name IS NOT NULL RETURN n.name AS name, n.msg_reply AS reply"
+
+    def __init__(self, index):
+        self.index = index
+        self.replies = {}
+        self.loaded_at = None
+
+    # Reload names and replies from Neo4j; the index only re-encodes names that were added
+    def refresh(self):
+        replies = {}
+        for record in run_query(self.query):
+            name_replies = replies.setdefault(record['name'], [])
+            if record['reply'] and record['reply'] not in name_replies:
+                name_replies.append(record['reply'])
+        changed = self.index.build(sorted(replies))
+        self.replies = replies
+        self.loaded_at = time.time()
+        return changed
+
+    def reply_for(self, name):
+        replies = self.replies.get(name)
+        return random.choice(replies) if replies else None
+
+    # Periodically pick up Greeting nodes added, removed or edited in Neo4j
+    def start(self, interval=GREETING_REFRESH_INTERVAL):
+        return run_periodically("greeting-refresher", interval, self.refresh)
+
+greetings = GreetingKnowledge(greeting_index)
+greetings_component = component("greetings", greetings.refresh)
+
+# Groups concurrent single-text encode requests into one encode call. The first request waits up to
+# `window` seconds for others (or until `max_batch` are pending), then the whole batch is encoded at once.
+class EncodeBatcher:
+    def __init__(self, window=ENCODE_BATCH_WINDOW, max_batch=ENCODE_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.batch_sizes = Counter()
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def encode(self, text):
+        future = Future()
+        with self._cond:
+            if self._thread is None:  # Started on first use so it is created after a fork
+                self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((text, future))
+            self._cond.notify()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self.batch_sizes[len(batch)] += 1
+            try:
+                vectors = get_encoder().encode([text for text, _ in batch], batch_size=len(batch))
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+# LRU cache of user-message embeddings keyed by normalized text, together with the greeting each
+# message matched. A cached match is only reused while the greeting index is unchanged.
+class QueryCache:
+    def __init__(self, size=QUERY_CACHE_SIZE, batcher=None):
+        self.size = size
+        self.batcher = batcher
+        self.counters = {"hits": 0, "misses": 0, "match_hits": 0, "match_misses": 0}
+        self._entries = OrderedDict()  # normalized text -> [vector, greeting index hash, match]
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def embedding(self, text):
+        key = normalize_message(text)
+        entry = self._entry(key)
+        if entry is not None:
+            self._count("hits")
+            return entry[0]
+        self._count("misses")
+        vector = self.batcher.encode(text) if self.batcher else get_encoder().encode(text)
+        with self._lock:
+            self._entries[key] = [vector, None, None]
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return vector
+
+    def greeting_match(self, text):
+        vector = self.embedding(text)
+        index_hash = greeting_index.corpus_hash
+        entry = self._entry(normalize_message(text))
+        if entry is not None and entry[1] == index_hash:
+            self._count("match_hits")
+            return entry[2]
+        self._count("match_misses")
+        matches = greeting_index.search(vector, k=1)
+
+        # Return the most similar greeting if it passes the threshold
+        match = matches[0][0] if matches and matches[0][1] > GREETING_THRESHOLD else None
+        if entry is not None:
+            entry[1], entry[2] = index_hash, match
+        return match
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        stats = {**counters, "entries": len(self._entries),
+                 "hit_ratio": round(counters["hits"] / lookups, 3) if lookups else None}
+        if self.batcher:
+            sizes = self.batcher.batch_sizes
+            batches = sum(sizes.values())
+            stats["batches"] = batches
+            stats["batch_size_mean"] = round(sum(size * n for size, n in sizes.items()) / batches, 2) if batches else None
+            stats["batch_sizes"] = dict(sorted(sizes.items()))
+        return stats
+
+query_cache = QueryCache(batcher=EncodeBatcher() if ENCODE_BATCH_WINDOW > 0 else None)
 
 # Function to compute similarity between user input and greetings
 def compute_similar(sentence):
-    greeting_vec = model.encode(greeting_corpus, convert_to_tensor=True, normalize_embeddings=True)
-    user_vec = model.encode(sentence, convert_to_tensor=True, normalize_embeddings=True)
-    similarities = util.cos_sim(greeting_vec, user_vec)
-    greeting_np = similarities.cpu().numpy()
-    
-    # Find the most similar greeting
-    max_greeting_score = np.argmax(greeting_np)
-    
-    if greeting_np[max_greeting_score] > 0.5:  # Threshold for greeting match
-        match_greeting = greeting_corpus[max_greeting_score]
-        return match_greeting
-    return None
+    if not greetings_component.ready:
+        return None  # Loaded in the background; never connect to Neo4j or load the model on the request path
+    return query_cache.greeting_match(sentence)
 
-# Function to fetch a response message from Neo4j based on the matched greeting
-def neo4j_search(greeting):
-    query = f"MATCH (n:Greeting) WHERE n.name = '{greeting}' RETURN n.msg_reply as reply"
-    results = run_query(query)
-    for record in results:
-        return record['reply']
-    return "Hello! How can I assist you?"
+# Function to get the response message for the matched greeting (one of its replies if it has several)
+def greeting_reply(greeting):
+    return greetings.reply_for(greeting) or "Hello! How can I assist you?"
 
 # Function to create the main Quick Reply options (Shoe, Collection, Product, Sale!!, General)
 def main_quick_reply():
@@ -88,112 +806,697 @@ def main_quick_reply():
     ])
 
 
-# Function to perform web scraping using Selenium and BeautifulSoup
-def scrape_converse(search_term):
-    base_url = "https://mustardsneakers.com"
-    url = f"{base_url}/search?type=product%2Carticle%2Cpage%2Ccollection&options%5Bprefix%5D=last&q={search_term}"
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(url)
-    driver.implicitly_wait(5)  # Wait for the page to load
+class BrowserPoolTimeout(Exception):
+    pass
+
+# A warm headless Chrome session and the number of pages it has loaded
+class BrowserSession:
+    def __init__(self, options):
+        chromedriver_component.get()
+        self.driver = webdriver.Chrome(options=options)
+        self.driver.implicitly_wait(5)
+        self.pages = 0
+
+    def healthy(self):
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+# Bounded pool of warm Chrome sessions shared by the scrape functions.
+# Sessions are started on demand up to `size`; when all are busy callers wait up to
+# `timeout` seconds and then get BrowserPoolTimeout instead of starting another Chrome.
+class BrowserPool:
+    def __init__(self, options, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES, timeout=BROWSER_CHECKOUT_TIMEOUT):
+        self.options = options
+        self.size = size
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()  # LIFO hands out the most recently used (warmest) session first
+        self._closed = False
+
+    def checkout(self, timeout=None):
+        if self._closed:
+            raise BrowserPoolTimeout("browser pool is closed")
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise BrowserPoolTimeout(f"no browser session free within {self.timeout}s")
+        try:
+            while True:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    return BrowserSession(self.options)
+                if session.healthy():
+                    return session
+                logger.warning("Discarding unhealthy browser session after %d pages", session.pages)
+                session.quit()
+        except Exception:
+            self._slots.release()
+            raise
 
-    # Parse the page source with BeautifulSoup
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    
-    product_elements = soup.find_all("div", {"class": "grid-product__content"})
+    def checkin(self, session, broken=False):
+        try:
+            session.pages += 1
+            if broken or self._closed or session.pages >= self.max_pages:
+                session.quit()
+            else:
+                self._idle.put(session)
+        finally:
+            self._slots.release()
+
+    # Usage: with browser_pool.browser() as driver: driver.get(url)
+    @contextlib.contextmanager
+    def browser(self, timeout=None):
+        with span("browser_checkout"):
+            session = self.checkout(timeout)
+        broken = False
+        try:
+            yield session.driver
+        except WebDriverException:
+            broken = True  # Crashed or hung Chrome; recycle instead of returning it to the pool
+            raise
+        finally:
+            self.checkin(session, broken)
+
+    # Start sessions ahead of the first request so the first user does not pay Chrome startup
+    def warm(self, count=1):
+        sessions = [self.checkout() for _ in range(min(count, self.size))]
+        for session in sessions:
+            session.pages -= 1  # Warm-up is not a served page
+            self.checkin(session)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().quit()
+            except queue.Empty:
+                break
+
+browser_pool = BrowserPool(chrome_options)
+
+# Lightweight fetch backend: plain HTTP with a pooled keep-alive session.
+# The shop pages are server-rendered, so this returns the same product grid as a browser.
+class HttpFetcher:
+    name = "http"
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = HTTP_USER_AGENT
+
+    @traced("http_fetch")
+    def get(self, url, **kwargs):
+        response = self.session.get(url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_html(self, url):
+        return self.get(url).text
+
+    def get_json(self, url, params=None):
+        return self.get(url, params=params).json()
+
+# Full browser backend, only used when the HTTP backend comes back empty
+class SeleniumFetcher:
+    name = "selenium"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get_html(self, url):
+        # Load the page in a warm browser from the pool (implicit wait is set once per session)
+        with self.pool.browser() as driver, span("browser_load"):
+            driver.get(url)
+            return driver.page_source
+
+http_fetcher = HttpFetcher()
+selenium_fetcher = SeleniumFetcher(browser_pool)
+fetchers = {"http": http_fetcher, "selenium": selenium_fetcher}
+
+# Fetch `url` and run `parse` on the HTML. With the "http" backend the page is fetched over plain HTTP
+# (then `json_fallback`, if given) and Selenium only runs when both return nothing.
+def fetch_parsed(url, parse, backend=None, json_fallback=None):
+    backend = backend or FETCH_BACKEND
+    if backend == "http":
+        try:
+            result = parse(http_fetcher.get_html(url))
+            if not result and json_fallback:
+                result = json_fallback()
+            if result:
+                return result
+            logger.info("HTTP backend found nothing at %s, falling back to Selenium", url)
+        except Exception as e:
+            logger.warning("HTTP backend failed for %s (%s), falling back to Selenium", url, e)
+    return parse(selenium_fetcher.get_html(url))
+
+# Extract product cards (name, price, image, url) from a product grid page
+@traced("parse")
+def extract_products(html, base_url=None, limit=None):
+    return extract.parse_products(html, base_url or BASE_URL, limit)
+
+def search_url(search_term):
+    return f"{BASE_URL}/search?type=product%2Carticle%2Cpage%2Ccollection&options%5Bprefix%5D=last&q={urllib.parse.quote(search_term)}"
+
+# Shopify predictive search JSON, used when the search page HTML has no product grid
+def search_suggest_products(search_term, limit=10):
+    data = http_fetcher.get_json(f"{BASE_URL}/search/suggest.json", params={
+        "q": search_term,
+        "resources[type]": "product",
+        "resources[limit]": limit,
+    })
     products_details = []
-    
-    for product in product_elements:
-        title = product.find("div", class_="grid-product__title--body")
-        price = product.find("div", class_="grid-product__price")
-        image = product.find("img", class_="lazyloaded")
-        link = product.find("a", href=True)
-
-        if title and price and image and link:
-            # Handle relative URL for images and product links
-            img_url = image.get('src') or image.get('data-srcset').split(',')[0].split(' ')[0]
-            img_url = urllib.parse.urljoin(base_url, img_url)  # Convert to absolute URL if it's relative
-            product_url = urllib.parse.urljoin(base_url, link['href'])  # Get product link
-
-            products_details.append({
-                'name': title.text.strip(),
-                'price': price.text.strip(),
-                'image': img_url,
-                'url': product_url  # Add product URL to the details
-            })
-    
-    driver.quit()
+    for item in data.get("resources", {}).get("results", {}).get("products", []):
+        if item.get("title") and item.get("url") and item.get("image"):
+            products_details.append(Product(item["title"].strip(), str(item.get("price", "")).strip(),
+                                            urllib.parse.urljoin(BASE_URL, item["image"]),
+                                            urllib.parse.urljoin(BASE_URL, item["url"].split("?")[0])))
     return products_details
 
+# Function to search products on the shop (HTTP first, Selenium as fallback)
+def scrape_converse(search_term, backend=None):
+    return fetch_parsed(search_url(search_term), extract_products, backend=backend,
+                        json_fallback=lambda: search_suggest_products(search_term))
+
 # ฟังก์ชันสแครปข้อมูลจากหน้า Best Selling
-def scrape_best_selling():
-    base_url = "https://mustardsneakers.com"
-    url = f"{base_url}/collections/all?sort_by=best-selling"
-    
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(url)
-    driver.implicitly_wait(5)  # รอให้หน้าโหลดเสร็จ
-
-    # Parse the page source with BeautifulSoup
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
-    
-    # ดึงข้อมูลสินค้าจากหน้า Best Selling
-    product_elements = soup.find_all("div", class_="grid-product__content", limit=8)  # ดึงมาแค่ 8 ชิ้นแรก
-    products_details = []
-    
-    for product in product_elements:
-        title = product.find("div", class_="grid-product__title--body")
-        price = product.find("div", class_="grid-product__price")
-        image = product.find("img", class_="lazyloaded")
-        link = product.find("a", href=True)
-
-        if title and price and image and link:
-            # Handle relative URL for images and product links
-            img_url = image.get('src') or image.get('data-srcset').split(',')[0].split(' ')[0]
-            img_url = urllib.parse.urljoin(base_url, img_url)  # Convert to absolute URL if it's relative
-            product_url = urllib.parse.urljoin(base_url, link['href'])  # Get product link
-
-            products_details.append({
-                'name': title.text.strip(),
-                'price': price.text.strip(),
-                'image': img_url,
-                'url': product_url  # Add product URL to the details
-            })
-
-    driver.quit()
-    return products_details
+def scrape_best_selling(backend=None):
+    url = f"{BASE_URL}/collections/all?sort_by=best-selling"
+    # ดึงข้อมูลสินค้าจากหน้า Best Selling แค่ 8 ชิ้นแรก
+    return fetch_parsed(url, lambda html: extract_products(html, limit=8), backend=backend)
+
+# Extract every (question, answer) pair from the FAQ page
+@traced("parse")
+def parse_faq(html):
+    return extract.parse_faq(html)
+
+# Function to scrape all FAQ entries from the Mustard Sneakers website
+def scrape_general_faq(backend=None):
+    return fetch_parsed(f"{BASE_URL}/pages/faq", parse_faq, backend=backend)
+
+# Every FAQ entry kept in memory (normalized question -> (question, answer)) with the questions embedded,
+# so menu taps and free-text questions are answered without fetching the page on the request path.
+# The page is re-read periodically; the index is only rebuilt when its content hash changes.
+class FaqStore:
+    def __init__(self, index):
+        self.index = index
+        self.entries = {}
+        self.content_hash = None
+        self.loaded_at = None
+
+    def refresh(self):
+        faqs = scrape_general_faq()
+        if not faqs:
+            raise ValueError("No FAQ entries found on the FAQ page")
+        content_hash = hashlib.sha256(json.dumps(faqs, ensure_ascii=False).encode("utf-8")).hexdigest()
+        changed = content_hash != self.content_hash
+        if changed:
+            self.index.build([question for question, _ in faqs])
+            self.entries = {normalize_message(question): (question, answer) for question, answer in faqs}
+            self.content_hash = content_hash
+            logger.info("FAQ: %d entries loaded", len(faqs))
+        self.loaded_at = time.time()
+        return changed
+
+    # Exact (normalized) question text
+    def lookup(self, text):
+        entry = self.entries.get(normalize_message(text))
+        return entry[0] if entry else None
+
+    # Closest question by embedding, if it passes the threshold
+    def match(self, text, threshold=FAQ_THRESHOLD):
+        if not self.entries or not len(self.index) or not model_component.ready:
+            return None
+        matches = self.index.search(query_cache.embedding(text), k=1)
+        return matches[0][0] if matches and matches[0][1] >= threshold else None
+
+    # Answer for a question, or for a menu number ("1"-"4"); menu questions that were reworded on
+    # the site are found by embedding
+    def answer(self, key):
+        question = FAQ_MENU.get(key, key)
+        entry = self.entries.get(normalize_message(question))
+        if entry is None:
+            matched = self.match(question)
+            entry = self.entries.get(normalize_message(matched)) if matched else None
+        return entry[1] if entry else None
+
+    def start(self, interval=FAQ_REFRESH_INTERVAL):
+        return run_periodically("faq-refresher", interval, self.refresh)
+
+faqs = FaqStore(EmbeddingIndex("faq"))
+faq_component = component("faq", faqs.refresh, required=False)
+
+# In-process cache backend: an LRU dict of key -> (value, stored_at)
+class MemoryCacheBackend:
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (value, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Base for SQLite-backed stores. sqlite3 connections cannot be shared between threads,
+# so each thread gets its own connection to the same WAL-mode database file.
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            self._create_schema(conn)
+        if hasattr(os, "register_at_fork"):
+            # A forked worker must open its own connections instead of reusing the parent's
+            os.register_at_fork(after_in_child=self._reset_connections)
+
+    def _reset_connections(self):
+        self._local = threading.local()
+
+    def _create_schema(self, conn):
+        pass
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+# Shared on-disk cache backend so several worker processes see the same warm entries.
+# Values are product lists, stored as JSON.
+class SqliteCacheBackend(SqliteStore):
+    def __init__(self, path=SEARCH_CACHE_PATH, max_entries=SEARCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def _create_schema(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                     "stored_at REAL NOT NULL, used_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_used_at ON cache (used_at)")
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE cache SET used_at = ? WHERE key = ?", (time.time(), key))
+        return [Product.from_dict(item) for item in json.loads(row[0])], row[1]
+
+    def set(self, key, value, stored_at):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, stored_at, used_at) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps([p.to_dict() for p in value], ensure_ascii=False), stored_at, time.time()))
+            conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                         (self.max_entries,))
+
+def normalize_search_term(term):
+    return " ".join(term.split()).casefold()
+
+# Read-through cache around a slow loader (e.g. scrape_converse).
+# Fresh entries are returned directly; entries up to `stale` seconds past their TTL are returned
+# immediately while one background refresh runs; concurrent misses for the same key share one load.
+class ResultCache:
+    def __init__(self, loader, backend, ttl=SEARCH_CACHE_TTL, stale=SEARCH_CACHE_STALE, empty_ttl=SEARCH_CACHE_EMPTY_TTL):
+        self.loader = loader
+        self.backend = backend
+        self.ttl = ttl
+        self.stale = stale
+        self.empty_ttl = empty_ttl
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, term):
+        key = normalize_search_term(term)
+        entry = self.backend.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            ttl = self.ttl if value else self.empty_ttl
+            age = time.time() - stored_at
+            if age < ttl:
+                self._count("hits")
+                return value
+            if age < ttl + self.stale:
+                self._count("stale_hits")
+                self._refresh_in_background(key, term)
+                return value
+        self._count("misses")
+        return self._load(key, term)
+
+    # Single-flight load: the first caller runs the loader, concurrent callers wait for its result
+    def _load(self, key, term):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            value = self.loader(term)
+            self.backend.set(key, value, time.time())
+            future.set_result(value)
+            return value
+        except Exception as e:
+            self._count("errors")
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key, term):
+        with self._lock:
+            if key in self._inflight:
+                return
+            self.stats["refreshes"] += 1
+
+        def refresh():
+            try:
+                self._load(key, term)
+            except Exception as e:
+                logger.warning("Background refresh of %r failed: %s", term, e)
+        self._refresher.submit(refresh)
+
+def make_cache_backend(name=SEARCH_CACHE_BACKEND):
+    if name == "sqlite":
+        return SqliteCacheBackend()
+    return MemoryCacheBackend()
+
+search_cache = ResultCache(scrape_converse, make_cache_backend())
+
+# Local catalog of every product on the shop with a full-text index over name, collection and description
+class CatalogStore(SqliteStore):
+    def __init__(self, path=CATALOG_DB_PATH):
+        super().__init__(path)
+
+    def _create_schema(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS products (url TEXT PRIMARY KEY, name TEXT NOT NULL, price TEXT, "
+                     "image TEXT, collection TEXT NOT NULL DEFAULT '', description TEXT NOT NULL DEFAULT '', "
+                     "seen_at REAL NOT NULL)")
+        # Validators for incremental re-crawls: unchanged pages are skipped by ETag/Last-Modified or content hash
+        conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                     "content_hash TEXT, items TEXT NOT NULL DEFAULT '[]', fetched_at REAL NOT NULL)")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+                         "url UNINDEXED, name, collection, description, tokenize='unicode61 remove_diacritics 2')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite was built without FTS5; catalog search falls back to LIKE")
+            self.fts = False
+
+    def page(self, url):
+        row = self._connection().execute("SELECT etag, last_modified, content_hash, items FROM pages WHERE url = ?",
+                                         (url,)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2],
+                "items": [Product.from_dict(item) for item in json.loads(row[3])]}
+
+    def save_page(self, url, etag, last_modified, content_hash, items):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, items, fetched_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (url, etag, last_modified, content_hash, json.dumps([p.to_dict() for p in items]), time.time()))
+
+    def product_urls(self):
+        return {row[0] for row in self._connection().execute("SELECT url FROM products")}
+
+    # Insert or update products; `collections` maps url -> set of collection handles seen in this crawl
+    def upsert(self, products, collections, descriptions, seen_at):
+        with self._connection() as conn:
+            for product in products:
+                url = product.url
+                row = conn.execute("SELECT description FROM products WHERE url = ?", (url,)).fetchone()
+                description = descriptions.get(url, row[0] if row else '')
+                collection = " ".join(sorted(collections.get(url, ())))
+                conn.execute("INSERT OR REPLACE INTO products (url, name, price, image, collection, description, seen_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (url, product.name, product.price, product.image, collection, description, seen_at))
+                if self.fts:
+                    conn.execute("DELETE FROM products_fts WHERE url = ?", (url,))
+                    conn.execute("INSERT INTO products_fts (url, name, collection, description) VALUES (?, ?, ?, ?)",
+                                 (url, product.name, collection, description))
 
-# Function to scrape specific FAQ answers from the Mustard Sneakers website
+    # Drop products that were not seen in a complete crawl
+    def remove_unseen(self, crawl_started):
+        with self._connection() as conn:
+            if self.fts:
+                conn.execute("DELETE FROM products_fts WHERE url IN (SELECT url FROM products WHERE seen_at < ?)",
+                             (crawl_started,))
+            return conn.execute("DELETE FROM products WHERE seen_at < ?", (crawl_started,)).rowcount
 
-def scrape_general_faq():
-    base_url = "https://mustardsneakers.com"
-    url = f"{base_url}/pages/faq"
-    
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(url)
-    driver.implicitly_wait(5)  # Wait for the page to load
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM products").fetchone()[0]
 
-    # Parse the page source with BeautifulSoup
-    html = driver.page_source
-    soup = BeautifulSoup(html, "html.parser")
+    def all(self):
+        rows = self._connection().execute("SELECT name, price, image, url, collection, description FROM products ORDER BY url")
+        return [dict(zip(("name", "price", "image", "url", "collection", "description"), row)) for row in rows]
 
-    # Extract the relevant <p> elements based on their corresponding questions
-    faqs = {}
+    @traced("catalog_search")
+    def search(self, term, limit=CATALOG_SEARCH_LIMIT):
+        tokens = [t for t in re.split(r"[^\w\u0E00-\u0E7F]+", term.casefold()) if t]
+        if not tokens:
+            return []
+        conn = self._connection()
+        if self.fts:
+            # Every token must match as a prefix, best bm25 rank first (name weighted highest)
+            match = " ".join('"' + t.replace('"', '""') + '"*' for t in tokens)
+            rows = conn.execute("SELECT p.name, p.price, p.image, p.url FROM products_fts f JOIN products p ON p.url = f.url "
+                                "WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 0, 10.0, 5.0, 1.0) LIMIT ?",
+                                (match, limit)).fetchall()
+        else:
+            where = " AND ".join(["(name || ' ' || collection || ' ' || description) LIKE ?"] * len(tokens))
+            rows = conn.execute(f"SELECT name, price, image, url FROM products WHERE {where} LIMIT ?",
+                                [f"%{t}%" for t in tokens] + [limit]).fetchall()
+        return [Product(*row) for row in rows]
+
+# Walks every collection and product page of the shop into a CatalogStore.
+# Pages are fetched in parallel (bounded by `concurrency`) with conditional requests,
+# and pages whose ETag/Last-Modified or content hash did not change are not re-parsed.
+class CatalogCrawler:
+    def __init__(self, store, concurrency=CATALOG_CRAWL_CONCURRENCY, max_pages=CATALOG_MAX_PAGES, on_update=None):
+        self.store = store
+        self.on_update = on_update  # Called after each completed crawl, e.g. to rebuild the product embeddings
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.last_crawl = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+
+    # Conditional GET; returns (body, changed)
+    def _fetch(self, url):
+        cached = self.store.page(url)
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        response = http_fetcher.get(url, headers=headers)
+        if response.status_code == 304:
+            return None, cached
+        body = response.text
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if cached and cached["content_hash"] == content_hash:
+            return None, cached
+        return body, {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"),
+                      "content_hash": content_hash}
+
+    def collections(self):
+        try:
+            data = http_fetcher.get_json(f"{BASE_URL}/collections.json", params={"limit": 250})
+            handles = [c["handle"] for c in data.get("collections", []) if c.get("handle")]
+            if handles:
+                return handles
+        except Exception as e:
+            logger.warning("Could not list collections (%s), using CATALOG_COLLECTIONS", e)
+        return list(CATALOG_COLLECTIONS)
+
+    # Returns the products of one collection, page by page, until a page adds nothing new
+    def crawl_collection(self, handle):
+        products = {}
+        for page in range(1, self.max_pages + 1):
+            url = f"{BASE_URL}/collections/{handle}?page={page}"
+            body, meta = self._fetch(url)
+            if body is None:
+                items = meta["items"]
+            else:
+                items = extract_products(body)
+                self.store.save_page(url, meta["etag"], meta["last_modified"], meta["content_hash"], items)
+            new = [p for p in items if p.url not in products]
+            if not new:
+                break
+            for product in new:
+                products[product.url] = product
+        return handle, list(products.values())
+
+    # Product description from Shopify's product JSON (None when unchanged since the last crawl)
+    def crawl_product(self, url):
+        try:
+            body, meta = self._fetch(url.split("?")[0] + ".json")
+        except Exception as e:
+            logger.warning("Could not fetch product details for %s: %s", url, e)
+            return url, None
+        if body is None:
+            return url, None
+        self.store.save_page(url.split("?")[0] + ".json", meta["etag"], meta["last_modified"], meta["content_hash"], [])
+        body_html = json.loads(body).get("product", {}).get("body_html") or ""
+        return url, " ".join(BeautifulSoup(body_html, "html.parser").get_text(" ").split())
+
+    def crawl(self):
+        if not self._lock.acquire(blocking=False):
+            logger.info("Catalog crawl already running")
+            return False
+        try:
+            started = time.time()
+            products, collections, descriptions = {}, {}, {}
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="crawler") as pool:
+                for handle, items in pool.map(self.crawl_collection, self.collections()):
+                    for product in items:
+                        products.setdefault(product.url, product)
+                        collections.setdefault(product.url, set()).add(handle)
+                known = self.store.product_urls()
+                for url, description in pool.map(self.crawl_product, list(products)):
+                    if description is not None or url not in known:
+                        descriptions[url] = description or ""
+            self.store.upsert(products.values(), collections, descriptions, started)
+            removed = self.store.remove_unseen(started) if products else 0
+            self.last_crawl = time.time()
+            logger.info("Catalog crawl finished in %.1fs: %d products, %d descriptions updated, %d removed",
+                        self.last_crawl - started, len(products), len(descriptions), removed)
+            if self.on_update:
+                self.on_update()
+            return True
+        finally:
+            self._lock.release()
+
+    # With several worker processes only the one holding the crawl lock file crawls; the others
+    # re-read the shared catalog so their product embeddings follow it. The same process also runs
+    # the other once-per-deployment jobs (chat retention).
+    def is_leader(self):
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            lock_file = open(self.store.path + ".crawl.lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file  # Held until the process exits
+        return True
+
+    def start(self, interval=CATALOG_CRAWL_INTERVAL):
+        def loop():
+            while True:
+                crawler = False
+                try:
+                    crawler = self.is_leader()
+                    if crawler:
+                        self.crawl()
+                    elif self.on_update:
+                        self.on_update()
+                except Exception as e:
+                    logger.warning("Catalog crawl failed: %s", e)
+                if stop.wait(interval if crawler else min(interval, CATALOG_SYNC_INTERVAL)):
+                    break
+        stop = threading.Event()
+        threading.Thread(target=loop, name="catalog-crawler", daemon=True).start()
+        return stop
 
-    # Get all FAQ content areas using the shared class
-    faq_contents = soup.find_all("div", {"class": "collapsible-content__inner collapsible-content__inner--faq rte"})
+# Semantic product search: catalog names, collections and descriptions embedded with the same
+# multilingual model as the greetings, so Thai or misspelled queries still find products.
+class ProductSemanticSearch:
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.products = {}
 
-    # Check if we have enough FAQ items
-    if len(faq_contents) >= 4:
-        # Map each content to the corresponding question
-        faqs['1'] = faq_contents[6].find("p").text.strip()  # ลองสินค้าจริงได้ที่ไหนบ้าง
-        faqs['2'] = faq_contents[7].find("p").text.strip()  # Mustard Sneakers เป็นแบรนด์ของที่ไหน
-        faqs['3'] = faq_contents[8].find("p").text.strip()  # รองเท้าทำมาจากวัสดุอะไร
-        faqs['4'] = faq_contents[9].find("p").text.strip()  # ทำความสะอาดรองเท้าอย่างไร
+    @staticmethod
+    def text(product):
+        return " | ".join(part for part in (product['name'], product['collection'], product['description'][:300]) if part)
 
-    driver.quit()
-    return faqs
+    # Re-embed the catalog; only products whose text changed are encoded again
+    def refresh(self):
+        products = self.store.all()
+        self.index.build([p['url'] for p in products], [self.text(p) for p in products])
+        self.products = {p['url']: Product.from_dict(p) for p in products}
+
+    def search(self, query, k=CATALOG_SEARCH_LIMIT, threshold=PRODUCT_MATCH_THRESHOLD):
+        if not len(self.index):
+            return []
+        query_vec = query_cache.embedding(query)
+        return [self.products[url] for url, score in self.index.search(query_vec, k)
+                if score >= threshold and url in self.products]
+
+catalog = CatalogStore()
+product_search = ProductSemanticSearch(catalog, EmbeddingIndex("products", dtype=PRODUCT_INDEX_DTYPE))
+catalog_component = component("catalog", product_search.refresh, required=False)
+catalog_crawler = CatalogCrawler(catalog, on_update=product_search.refresh)
+
+# Function to search products: keyword match in the local catalog, then semantic match,
+# then the (cached) live site search
+def search_products(search_term):
+    products = catalog.search(search_term)
+    if not products and model_component.ready:  # Never wait for the model on the request path
+        try:
+            products = product_search.search(search_term)
+        except Exception as e:
+            logger.warning("Semantic product search failed, using the live search: %s", e)
+    if products:
+        return products
+    return search_cache.get(search_term)
+
+# Fetch the same pages with every backend and report parity and latency.
+# Run against the fixture server (python fixture_server.py, SCRAPE_BASE_URL=http://127.0.0.1:8765)
+# to compare offline.
+def compare_backends(search_terms=("RISE COFFEE", "Socks", "MAVERICKS"), rounds=3):
+    pages = [(f"search:{term}", search_url(term), extract_products) for term in search_terms]
+    pages.append(("best-selling", f"{BASE_URL}/collections/all?sort_by=best-selling", lambda html: extract_products(html, limit=8)))
+    pages.append(("faq", f"{BASE_URL}/pages/faq", parse_faq))
+
+    report = []
+    for label, url, parse in pages:
+        row = {"page": label}
+        results = {}
+        for name, fetcher in fetchers.items():
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                results[name] = parse(fetcher.get_html(url))
+                timings.append((time.perf_counter() - started) * 1000)
+            row[f"{name}_items"] = len(results[name])
+            row[f"{name}_ms"] = round(statistics.median(timings), 1)
+        row["parity"] = results["http"] == results["selenium"]
+        report.append(row)
+    return report
 
 def general_quick_reply():
     return QuickReply(items=[
@@ -204,69 +1507,90 @@ def general_quick_reply():
         QuickReplyButton(action=MessageAction(label="Back", text="menu"))  # Go back to main menu
     ])
 
-# ฟังก์ชันเพื่อส่ง Flex Message สำหรับสินค้า Best Selling
-def send_best_selling_flex_message(reply_token):
-    products = scrape_best_selling()
-    
-    if not products:
-        text_message = TextSendMessage(text="ไม่พบสินค้าที่แนะนำ.")
-        line_bot_api.reply_message(reply_token, text_message)
-        return
-
-    # Generate Flex Message bubbles with button linking to the product URL
-    bubbles = [{
+# Renders product carousels from a bubble template compiled once into JSON fragments, so a bubble
+# is a string join instead of a nested dict that is built and then serialized. Rendered Flex
+# messages are cached by their product set: best-sellers and popular categories reuse the same JSON.
+class FlexRenderer:
+    bubble = {
         "type": "bubble",
-        "hero": {
-            "type": "image",
-            "url": prod['image'],
-            "size": "full",
-            "aspectRatio": "20:13",
-            "aspectMode": "cover"
-        },
+        "hero": {"type": "image", "url": "{{image}}", "size": "full", "aspectRatio": "20:13", "aspectMode": "cover"},
         "body": {
             "type": "box",
             "layout": "vertical",
             "contents": [
-                {"type": "text", "text": prod['name'], "weight": "bold", "size": "md", "wrap": True},
-                {"type": "text", "text": f"Price: {prod['price']}", "size": "sm", "color": "#999999"}
+                {"type": "text", "text": "{{name}}", "weight": "bold", "size": "md", "wrap": True},
+                {"type": "text", "text": "Price: {{price}}", "size": "sm", "color": "#999999"}
             ]
         },
         "footer": {
             "type": "box",
             "layout": "vertical",
             "spacing": "sm",
-            "contents": [
-                {
-                    "type": "button",
-                    "style": "primary",  # ใช้สีเพื่อให้ปุ่มโดดเด่น
-                    "height": "sm",
-                    "color": "#905c44",
-                    "action": {
-                        "type": "uri",
-                        "label": "ดูสินค้า",
-                        "uri": prod['url']
-                    }
-                }
-            ],
+            "contents": [{
+                "type": "button",
+                "style": "primary",  # ใช้สีเพื่อให้ปุ่มโดดเด่น
+                "height": "sm",
+                "color": "#905c44",
+                "action": {"type": "uri", "label": "ดูสินค้า", "uri": "{{url}}"}  # Link to product page
+            }],
             "flex": 0
         }
-    } for prod in products]
+    }
 
-    # สร้าง Flex Message content
-    contents = {"type": "carousel", "contents": bubbles}
+    def __init__(self, max_bubbles=FLEX_MAX_BUBBLES, cache_size=FLEX_CACHE_SIZE):
+        self.max_bubbles = max_bubbles
+        self.cache_size = cache_size
+        self.counters = {"hits": 0, "misses": 0}
+        # Literal JSON text alternating with the product field to insert: [text, field, text, ...]
+        self._parts = re.split(r"\{\{(\w+)\}\}", json.dumps(self.bubble, ensure_ascii=False, separators=(",", ":")))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
 
-    flex_message = FlexSendMessage(
-        alt_text="Best Selling Products",
-        contents=contents
-    )
+    def _bubble(self, product):
+        parts = self._parts
+        return "".join(part if i % 2 == 0 else json.dumps(getattr(product, part), ensure_ascii=False)[1:-1]
+                       for i, part in enumerate(parts))
+
+    # Flex message JSON with a carousel of the first max_bubbles products
+    def carousel(self, products, alt_text):
+        key = (alt_text, tuple(products[:self.max_bubbles]))
+        with self._lock:
+            message = self._cache.get(key)
+            if message is not None:
+                self._cache.move_to_end(key)
+                self.counters["hits"] += 1
+                return message
+        message = '{"type":"flex","altText":%s,"contents":{"type":"carousel","contents":[%s]}}' % (
+            json.dumps(alt_text, ensure_ascii=False), ",".join(self._bubble(product) for product in key[1]))
+        with self._lock:
+            self.counters["misses"] += 1
+            self._cache[key] = message
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return message
+
+flex_renderer = FlexRenderer()
+
+# Text message with the main quick reply, serialized once per text
+@functools.lru_cache(maxsize=64)
+def text_with_menu_json(text):
+    return json.dumps(TextSendMessage(text=text, quick_reply=main_quick_reply()).as_json_dict(), ensure_ascii=False)
+
+# ฟังก์ชันเพื่อส่ง Flex Message สำหรับสินค้า Best Selling
+def send_best_selling_flex_message(reply_token):
+    products = scrape_best_selling()
+
+    if not products:
+        text_message = TextSendMessage(text="ไม่พบสินค้าที่แนะนำ.")
+        line_bot_api.reply_message(reply_token, text_message)
+        return
 
     # ตอบกลับด้วย Flex Message
-    line_bot_api.reply_message(reply_token, [
-        flex_message,
-        TextSendMessage(text="นี่คือสินค้าที่แนะนำ", quick_reply=main_quick_reply())
+    line_bot_api.reply_json(reply_token, [
+        flex_renderer.carousel(products, "Best Selling Products"),
+        text_with_menu_json("นี่คือสินค้าที่แนะนำ")
     ])
 
-# Function to send Flex Message with product details
 # Function to send Flex Message with product details
 def send_flex_message(reply_token, products):
     if not products:
@@ -277,225 +1601,749 @@ def send_flex_message(reply_token, products):
         line_bot_api.reply_message(reply_token, text_message)
         return
 
-    # Generate Flex Message bubbles with button linking to the product URL
-    bubbles = [{
-        "type": "bubble",
-        "hero": {
-            "type": "image",
-            "url": prod['image'],  # Use absolute URL for the image
-            "size": "full",
-            "aspectRatio": "20:13",
-            "aspectMode": "cover"
-        },
-        "body": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": [
-                {"type": "text", "text": prod['name'], "weight": "bold", "size": "md", "wrap": True},
-                {"type": "text", "text": f"Price: {prod['price']}", "size": "sm", "color": "#999999"}
-            ]
-        },
-        "footer": {
-            "type": "box",
-            "layout": "vertical",
-            "spacing": "sm",
-            "contents": [
-                {
-                    "type": "button",
-                    "style": "primary",  # Changed to 'primary' for colored button
-                    "height": "sm",
-                    "color": "#905c44",  # You can change this color to any color you like
-                    "action": {
-                        "type": "uri",
-                        "label": "ดูสินค้า",
-                        "uri": prod['url']  # Link to product page
-                    }
-                }
-            ],
-            "flex": 0
-        }
-    } for prod in products]
+    # Reply with Flex Message and include additional message about product options
+    line_bot_api.reply_json(reply_token, [
+        flex_renderer.carousel(products, "Product List"),
+        text_with_menu_json("นี่คือสินค้าที่คุณสนใจ สามารถกดดูสินค้า หรือเลือกดูสินค้าอื่นๆต่อไปได้ครับ")  # ข้อความที่ต้องการแสดงเพิ่ม
+    ])
 
-    # Create Flex Message content
-    contents = {"type": "carousel", "contents": bubbles}
+# Buffers chat history records and writes them to Neo4j in batches on a background thread,
+# so replying never waits for a Neo4j round trip. Each batch is one UNWIND query.
+class ChatHistoryWriter:
+    # Create or update each user with their message and bot's reply, and link a new Chat node to them
+    query = (
+        "UNWIND $rows AS row "
+        "MERGE (u:User {user_id: row.user_id}) "  # Create user node if it doesn't exist
+        "ON CREATE SET u.created_at = row.timestamp "  # Set creation time when user is first created
+        "SET u.last_message = row.message, u.last_reply = row.reply, u.updated_at = row.timestamp "  # Rows are applied in order, so the newest wins
+        "CREATE (c:Chat {message: row.message, reply: row.reply, timestamp: row.timestamp}) "  # Create a new chat node for this interaction
+        "CREATE (u)-[:HAS_CHAT]->(c)"  # Link the user to their chat history (c is always new, so no MERGE needed)
+    )
+
+    def __init__(self, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL,
+                 buffer_size=HISTORY_BUFFER_SIZE, when_full=HISTORY_WHEN_FULL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.when_full = when_full  # "drop" new records or "block" the caller when the buffer is full
+        self.counters = {"queued": 0, "written": 0, "dropped": 0, "batches": 0, "retries": 0}
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, user_id, message, reply, timestamp=None):
+        record = {"user_id": user_id, "message": message, "reply": reply,
+                  "timestamp": int((timestamp or time.time()) * 1000)}  # Milliseconds, like Cypher timestamp()
+        try:
+            if self.when_full == "block":
+                self._buffer.put(record, timeout=HISTORY_BLOCK_TIMEOUT)
+            else:
+                self._buffer.put_nowait(record)
+            self._count("queued")
+            return True
+        except queue.Full:
+            self._count("dropped")
+            logger.warning("Chat history buffer full, dropping record for %s", user_id)
+            return False
+
+    # Collect up to batch_size records, waiting at most flush_interval after the first one
+    def _next_batch(self):
+        try:
+            batch = [self._buffer.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(HISTORY_MAX_RETRIES + 1):
+            try:
+                with span("neo4j_write"), get_driver().session() as session:
+                    session.run(self.query, rows=batch).consume()
+                self._count("batches")
+                self._count("written", len(batch))
+                return True
+            except Exception as e:
+                if attempt == HISTORY_MAX_RETRIES or (self._stop.is_set() and attempt >= 1):
+                    self._count("dropped", len(batch))
+                    logger.error("Dropping %d chat history records after %d attempts: %s", len(batch), attempt + 1, e)
+                    return False
+                self._count("retries")
+                delay = HISTORY_RETRY_BACKOFF * (2 ** attempt)
+                logger.warning("Chat history write failed (%s), retrying in %.1fs", e, delay)
+                time.sleep(delay)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._buffer.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def pending(self):
+        return self._buffer.qsize()
 
-    flex_message = FlexSendMessage(
-        alt_text="Product List",
-        contents=contents
+    # Flush everything still buffered, then stop the writer thread
+    def close(self, timeout=HISTORY_DRAIN_TIMEOUT):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._buffer.qsize():
+            logger.error("Chat history writer stopped with %d records unwritten", self._buffer.qsize())
+
+history_writer = ChatHistoryWriter()
+
+# Function to save chat history to Neo4j (buffered; written in batches by history_writer)
+def save_chat_history(user_id, user_message, bot_reply):
+    history_writer.add(user_id, user_message, bot_reply)
+
+# Constraints and indexes the bot's queries rely on; IF NOT EXISTS makes this safe to run on every start.
+# The User constraint backs the MERGE in every history write, so it stays an index lookup as users grow.
+NEO4J_SCHEMA = [
+    "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.user_id IS UNIQUE",
+    "CREATE INDEX greeting_name IF NOT EXISTS FOR (n:Greeting) ON (n.name)",
+    "CREATE INDEX chat_timestamp IF NOT EXISTS FOR (c:Chat) ON (c.timestamp)",
+    "CREATE INDEX chat_summary_day IF NOT EXISTS FOR (s:ChatSummary) ON (s.day)",
+]
+
+def ensure_neo4j_schema():
+    with get_driver().session() as session:
+        for statement in NEO4J_SCHEMA:
+            try:
+                session.run(statement).consume()
+            except Exception as e:
+                # e.g. duplicate user_id values left by older versions block the constraint
+                logger.warning("Neo4j schema: %s failed: %s", statement.split(" IF ")[0], e)
+
+neo4j_schema_component = component("neo4j_schema", ensure_neo4j_schema, required=False)
+
+# Keeps the Chat history bounded: chats older than the retention period are rolled into one
+# ChatSummary per user and day (message count and time range), then deleted, in bounded batches
+# so no transaction grows with the size of the backlog.
+class ChatRetention:
+    query = (
+        "MATCH (c:Chat) WHERE c.timestamp < $cutoff "  # chat_timestamp index range scan
+        "WITH c ORDER BY c.timestamp LIMIT $batch "
+        "OPTIONAL MATCH (u:User)-[:HAS_CHAT]->(c) "
+        "WITH u, date(datetime({epochMillis: c.timestamp, timezone: $timezone})) AS day, "
+        "collect(c) AS chats, min(c.timestamp) AS first_at, max(c.timestamp) AS last_at "
+        "FOREACH (_ IN CASE WHEN u IS NULL THEN [] ELSE [1] END | "
+        "MERGE (u)-[:HAS_SUMMARY]->(s:ChatSummary {day: day}) "
+        "SET s.messages = coalesce(s.messages, 0) + size(chats), "
+        "s.first_at = CASE WHEN s.first_at IS NULL OR first_at < s.first_at THEN first_at ELSE s.first_at END, "
+        "s.last_at = CASE WHEN s.last_at IS NULL OR last_at > s.last_at THEN last_at ELSE s.last_at END) "
+        "WITH chats UNWIND chats AS c "
+        "DETACH DELETE c "
+        "RETURN count(*) AS deleted"
     )
 
-    # Reply with Flex Message and include additional message about product options
-    line_bot_api.reply_message(reply_token, [
-        flex_message,
+    def __init__(self, days=CHAT_RETENTION_DAYS, batch=CHAT_RETENTION_BATCH, max_batches=CHAT_RETENTION_MAX_BATCHES):
+        self.days = days
+        self.batch = batch
+        self.max_batches = max_batches
+        self.counters = {"runs": 0, "summarized": 0}
+        self._lock = threading.Lock()
+
+    # Returns the number of Chat nodes rolled up and deleted
+    def run(self):
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            cutoff = int((time.time() - self.days * 86400) * 1000)  # Chat timestamps are in milliseconds
+            total = 0
+            for _ in range(self.max_batches):
+                with span("neo4j_write"), get_driver().session() as session:
+                    record = session.run(self.query, cutoff=cutoff, batch=self.batch, timezone=CHAT_SUMMARY_TIMEZONE).single()
+                deleted = record["deleted"] if record else 0
+                total += deleted
+                if deleted < self.batch:
+                    break
+            self.counters["runs"] += 1
+            self.counters["summarized"] += total
+            logger.info("Chat retention: %d chats older than %d days summarized and deleted", total, self.days)
+            return total
+        finally:
+            self._lock.release()
+
+    # Runs only in the leader process (is_leader), shortly after startup and then every interval
+    def start(self, is_leader, interval=CHAT_RETENTION_INTERVAL, first_delay=CHAT_RETENTION_START_DELAY):
+        def run_if_leader():
+            if is_leader():
+                self.run()
+        return run_periodically("chat-retention", interval, run_if_leader, first_delay=first_delay)
+
+chat_retention = ChatRetention()
+
+
+# คำภาษาไทยที่แปลงเป็นหมวดหมู่สินค้าภาษาอังกฤษ (registered as exact and keyword intents below)
+CATEGORY_ALIASES = {
+    "เสื้อ": "Shirts",
+    "กระเป๋า": "Tote Bag",
+    "ถุงเท้า": "Socks",
+    "กางเกง": "Pants",
+    "หมวก": "Hats",
+    "รองเท้า": "Shoe"
+}
+
+# Sub-menus shown for the main categories: reply text and quick reply options
+SUBMENUS = {
+    "Shoe": ("สนใจรองเท้ารุ่นไหน? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ",
+             ["RISE COFFEE", "MAISON KEEPS", "GAT", "ASTRO", "ALEXIS", "BUMPER", "COOPER", "SLIP ON", "MACC", "HI TOP"]),
+    "Collection": ("สนใจ Collection ไหนครับ? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ",
+                   ["MAVERICKS", "ODYSSEE", "MIDNIGHT SUN", "MACC"]),
+    "Product": ("สนใจอะไรครับ? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ",
+                ["Shirts", "Tote Bag", "Socks", "Pants", "Hats"]),
+}
+
+GENERAL_MENU_TEXT = 'คำถามทั่วไป\n' + '\n'.join(f"{number}.{question}" for number, question in FAQ_MENU.items())
+
+IncomingMessage = namedtuple("IncomingMessage", "reply_token user_id text")
+
+def normalize_message(text):
+    return " ".join(text.split()).casefold()
+
+# Table-driven intent routing. A message is resolved in tiers, cheapest first:
+#   exact    - normalized dictionary lookup (quick reply taps, menu words), then lookup tables
+#              that change at runtime (FAQ questions)
+#   keyword  - longest registered keyword the message starts with (trie; includes the Thai aliases)
+#   semantic - matchers backed by the embedding model, tried in registration order
+#   fallback - everything else (product search)
+# Handlers are registered with the on_* decorators and receive (message, arg); they return the
+# bot reply to save in the chat history, or None.
+class IntentRouter:
+    def __init__(self):
+        self.exact = {}
+        self.lookups = []
+        self.keywords = {}  # Trie of characters; the None key holds (handler, arg)
+        self.semantic = []
+        self.fallback = None
+        self.counters = {"exact": 0, "keyword": 0, "semantic": 0, "fallback": 0}
+        self.matcher_errors = Counter()  # Semantic matcher name -> failures (treated as no match)
+        self._lock = threading.Lock()
+
+    def on_exact(self, *phrases, arg=None):
+        def register(handler):
+            for phrase in phrases:
+                self.exact[normalize_message(phrase)] = (handler, arg)
+            return handler
+        return register
+
+    # lookup(text) returns a match, passed to the handler as arg, or None; tried with the exact tier
+    def on_lookup(self, lookup):
+        def register(handler):
+            self.lookups.append((lookup, handler))
+            return handler
+        return register
+
+    def on_keyword(self, *keywords, arg=None):
+        def register(handler):
+            for keyword in keywords:
+                node = self.keywords
+                for char in normalize_message(keyword):
+                    node = node.setdefault(char, {})
+                node[None] = (handler, arg)
+            return handler
+        return register
+
+    # matcher(text) returns a match, passed to the handler as arg, or None
+    def on_semantic(self, matcher):
+        def register(handler):
+            self.semantic.append((matcher, handler))
+            return handler
+        return register
+
+    def on_fallback(self, handler):
+        self.fallback = handler
+        return handler
+
+    # Longest keyword that prefixes the text; latin keywords must end on a word boundary ("hat" != "hate")
+    def _match_keyword(self, text):
+        node, found = self.keywords, None
+        for i, char in enumerate(text):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                following = text[i + 1:i + 2]
+                if not (char.isascii() and char.isalnum() and following.isascii() and following.isalnum()):
+                    found = node[None]
+        return found
+
+    def resolve(self, text):
+        normalized = normalize_message(text)
+        route = self.exact.get(normalized)
+        if route:
+            return "exact", route[0], route[1]
+        for lookup, handler in self.lookups:
+            match = lookup(normalized)
+            if match is not None:
+                return "exact", handler, match
+        route = self._match_keyword(normalized)
+        if route:
+            return "keyword", route[0], route[1]
+        for matcher, handler in self.semantic:
+            try:
+                match = matcher(text)
+            except Exception as e:
+                # A broken dependency (Neo4j, the model) must not cost the user the fallback reply
+                with self._lock:
+                    self.matcher_errors[matcher.__name__] += 1
+                logger.warning("Semantic matcher %s failed, treating as no match: %s", matcher.__name__, e)
+                continue
+            if match is not None:
+                return "semantic", handler, match
+        return "fallback", self.fallback, None
+
+    def dispatch(self, message):
+        with span("route"):
+            tier, handler, arg = self.resolve(message.text)
+        with self._lock:
+            self.counters[tier] += 1
+        _trace.intent = tier
+        return handler(message, arg)
+
+router = IntentRouter()
+
+# ตรวจสอบว่าผู้ใช้พิมพ์ข้อความเฉพาะเพื่อเรียก main_quick_reply
+@router.on_exact("menu", "เมนู", "main", "quick reply")  # เพิ่มคำที่ต้องการให้ตอบกลับด้วย quick reply
+@router.on_keyword("เมนู")
+def show_main_menu(message, arg):
+    bot_reply = "เลือกหมวดหมู่ที่คุณสนใจ"
+    line_bot_api.reply_message(message.reply_token, [
+        TextSendMessage(text=bot_reply, quick_reply=main_quick_reply())
+    ])
+    return bot_reply
+
+# ตรวจสอบว่าข้อความเป็นคำภาษาไทยและแปลงเป็นหมวดหมู่ภาษาอังกฤษ (Shirts, Tote Bag, etc.)
+def show_category(message, category):
+    products = search_products(category)
+    send_flex_message(message.reply_token, products)
+    return f"แสดงสินค้าสำหรับ {category}"
+
+for thai_name, category in CATEGORY_ALIASES.items():
+    router.on_exact(thai_name, arg=category)(show_category)
+    router.on_keyword(thai_name, arg=category)(show_category)
+
+# แยกเคสของ "Sale!!" ออกจากการตรวจสอบ greeting
+@router.on_exact("Sale!!")
+def show_sale(message, arg):
+    bot_reply = "ยังไม่มีรุ่นไหนลดราคา"
+    line_bot_api.reply_message(message.reply_token, TextSendMessage(text=bot_reply, quick_reply=main_quick_reply()))
+    return bot_reply
+
+# ถามคำแนะนำหรือ Best Selling
+@router.on_exact("ขอคำแนะนำ", "แนะนำ", "recommend", "best selling")
+@router.on_keyword("ขอคำแนะนำ", "แนะนำ", "recommend", "best selling")
+def show_best_selling(message, arg):
+    send_best_selling_flex_message(message.reply_token)
+    return None
+
+# Handle each main category selection (Shoe, Collection, Product)
+def show_submenu(message, name):
+    bot_reply, options = SUBMENUS[name]
+    quick_reply = QuickReply(items=[
+        QuickReplyButton(action=MessageAction(label=option, text=option)) for option in options
+    ])
+    line_bot_api.reply_message(message.reply_token, TextSendMessage(text=bot_reply, quick_reply=quick_reply))
+    return bot_reply
+
+for submenu in SUBMENUS:
+    router.on_exact(submenu, arg=submenu)(show_submenu)
+
+@router.on_exact("General")
+def show_general_menu(message, arg):
+    line_bot_api.reply_message(message.reply_token, [TextSendMessage(text=GENERAL_MENU_TEXT, quick_reply=general_quick_reply())])
+    return GENERAL_MENU_TEXT
+
+# Handle each numbered FAQ selection, and FAQ questions typed in full (before the keyword tier, so
+# "รองเท้าทำมาจากวัสดุอะไร" is not taken as the รองเท้า category) or close enough by embedding
+@router.on_lookup(faqs.lookup)
+@router.on_semantic(faqs.match)
+# The FAQ is loaded by the faq component and the refresher, never fetched on the request path;
+# until then the "not found" reply is sent
+def show_faq_answer(message, question):
+    bot_reply = faqs.answer(question) or "ขออภัย ไม่พบคำตอบสำหรับคำถามนี้"
+    line_bot_api.reply_message(message.reply_token, [
+        TextSendMessage(text=bot_reply),  # First message: Display the answer (or the error message)
         TextSendMessage(
-            text="นี่คือสินค้าที่คุณสนใจ สามารถกดดูสินค้า หรือเลือกดูสินค้าอื่นๆต่อไปได้ครับ",  # ข้อความที่ต้องการแสดงเพิ่ม
-            quick_reply=main_quick_reply()  # เพิ่ม Quick Reply ให้ผู้ใช้เลือกต่อ
+            text=GENERAL_MENU_TEXT,
+            quick_reply=general_quick_reply()  # Second message: Show the "General" menu again
         )
     ])
+    return bot_reply
 
-# Function to save chat history to Neo4j
-def save_chat_history(user_id, user_message, bot_reply):
-    with driver.session() as session:
-        # Create or update the user with their message and bot's reply in Neo4j
-        query = (
-            "MERGE (u:User {user_id: $user_id}) "  # Create user node if it doesn't exist
-            "ON CREATE SET u.created_at = timestamp() "  # Set creation time when user is first created
-            "SET u.last_message = $message, u.last_reply = $reply, u.updated_at = timestamp() "  # Update message and timestamp
-            "CREATE (c:Chat {message: $message, reply: $reply, timestamp: timestamp()}) "  # Create a new chat node for this interaction
-            "MERGE (u)-[:HAS_CHAT]->(c) "  # Link the user to their chat history
-        )
-        session.run(query, user_id=user_id, message=user_message, reply=bot_reply)
-
-
-# ฟังก์ชันแปลงข้อความภาษาไทยเป็นหมวดหมู่สินค้า
-def translate_to_english(thai_text):
-    translation_map = {
-        "เสื้อ": "Shirts",
-        "กระเป๋า": "Tote Bag",
-        "ถุงเท้า": "Socks",
-        "กางเกง": "Pants",
-        "หมวก": "Hats",
-        "รองเท้า": "Shoe"
-    }
-    return translation_map.get(thai_text, None)
+for number in FAQ_MENU:
+    router.on_exact(number, arg=number)(show_faq_answer)
 
-# ปรับปรุง linebot() เพื่อให้บอทตอบสนองต่อชื่อภาษาไทย
+# ตรวจสอบข้อความ greeting ปกติ (only reached when the cheaper tiers miss)
+@router.on_semantic(compute_similar)
+def reply_greeting(message, matched_greeting):
+    # Reply for the matched greeting from the in-memory greeting knowledge
+    bot_reply = greeting_reply(matched_greeting)
+    line_bot_api.reply_message(message.reply_token, [
+        TextSendMessage(text=bot_reply),
+        TextSendMessage(text="เลือกหมวดหมู่ หรือ รุ่นที่สนใจ หรือ พิมพ์ แนะนำ เพื่อดูสินค้าขายดีได้ครับ", quick_reply=main_quick_reply())
+    ])
+    return bot_reply
+
+@router.on_fallback
+def show_search_results(message, arg):
+    # Handle product selections and search the catalog / site
+    products = search_products(message.text)
+    send_flex_message(message.reply_token, products)
+    return f"แสดงสินค้าสำหรับ {message.text}"
+
+# Handle one LINE event (runs on an event worker thread)
+def handle_event(event):
+    if event.get('type') != 'message' or event.get('message', {}).get('type') != 'text':
+        return 'OK'  # Only text messages get a reply
+    try:
+        with trace_event(event.get('webhookEventId')):
+            message = IncomingMessage(event['replyToken'], event['source']['userId'], event['message']['text'])
+            bot_reply = router.dispatch(message)
+            if bot_reply:
+                save_chat_history(message.user_id, message.text, bot_reply)
+    except Exception as e:
+        logger.exception("Error processing the LINE event: %s", e)
+
+    return 'OK'
+
+# Runs webhook events on a fixed set of worker threads so the webhook can acknowledge at once.
+# Events are sharded by chat (user, group or room) so each chat's messages are handled in order,
+# and redelivered events are dropped by webhookEventId.
+class EventDispatcher:
+    def __init__(self, handler, workers=EVENT_WORKERS, queue_size=EVENT_QUEUE_SIZE):
+        self.handler = handler
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.counters = {"received": 0, "processed": 0, "failed": 0, "duplicates": 0, "rejected": 0}
+        self.wait_ms = deque(maxlen=EVENT_LATENCY_WINDOW)  # Time spent queued
+        self.handle_ms = deque(maxlen=EVENT_LATENCY_WINDOW)  # Time spent in the handler
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+
+    def start(self):
+        if self._threads:
+            return
+        self._threads = [threading.Thread(target=self._work, args=(q,), name=f"event-worker-{i}", daemon=True)
+                         for i, q in enumerate(self.queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # Queue one event; returns False when the queue is full or the dispatcher is shutting down
+    # (duplicates count as accepted)
+    def submit(self, event):
+        self._count("received")
+        if self._closed:
+            self._count("rejected")
+            return False  # LINE redelivers it, to a process that is still running
+        event_id = event.get('webhookEventId')
+        if event_id:
+            with self._lock:
+                if event_id in self._seen:
+                    self.counters["duplicates"] += 1
+                    return True
+                self._seen[event_id] = True
+                while len(self._seen) > EVENT_DEDUP_SIZE:
+                    self._seen.popitem(last=False)
+        source = event.get('source', {})
+        chat_id = source.get('groupId') or source.get('roomId') or source.get('userId') or ''
+        shard = self.queues[zlib.crc32(chat_id.encode("utf-8")) % len(self.queues)]
+        try:
+            shard.put((event, time.perf_counter()), timeout=EVENT_ENQUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            self._count("rejected")
+            if event_id:
+                with self._lock:
+                    self._seen.pop(event_id, None)  # Let LINE's redelivery through
+            logger.error("Event queue full, rejecting event %s", event_id)
+            return False
+
+    def _work(self, events):
+        stopping = False
+        while True:
+            if stopping:
+                try:
+                    item = events.get_nowait()  # Events queued while the sentinel was being added
+                except queue.Empty:
+                    break
+            else:
+                item = events.get()
+            if item is None:
+                stopping = True
+                continue
+            event, enqueued = item
+            started = time.perf_counter()
+            metrics.observe("event_queue_wait_seconds", started - enqueued)
+            try:
+                self.handler(event)
+                self._count("processed")
+            except Exception as e:
+                self._count("failed")
+                logger.exception("Event handler failed: %s", e)
+            finally:
+                finished = time.perf_counter()
+                self.wait_ms.append((started - enqueued) * 1000)
+                self.handle_ms.append((finished - started) * 1000)
+                events.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self):
+        def summary(samples):
+            samples = sorted(samples)
+            if not samples:
+                return {"count": 0}
+            return {"count": len(samples), "p50": round(samples[len(samples) // 2], 1),
+                    "p95": round(samples[int(len(samples) * 0.95)], 1), "max": round(samples[-1], 1)}
+        with self._lock:
+            counters = dict(self.counters)
+        return {"queue_depth": self.depth(), "queue_depth_per_worker": [q.qsize() for q in self.queues],
+                **counters, "wait_ms": summary(self.wait_ms), "handle_ms": summary(self.handle_ms)}
+
+    # Stop accepting work and let the workers finish what is already queued
+    def shutdown(self, timeout=EVENT_DRAIN_TIMEOUT):
+        if not self._threads:
+            return
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        for events in self.queues:
+            try:
+                events.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.error("Event queue still full at shutdown, %d events not handled", events.qsize())
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+event_dispatcher = EventDispatcher(handle_event)
+
+# Webhook: acknowledge at once and hand every event in the delivery to the workers
 @app.route("/", methods=['POST'])
 def linebot():
     body = request.get_data(as_text=True)
     try:
         json_data = json.loads(body)
-        reply_token = json_data['events'][0]['replyToken']
-        user_id = json_data['events'][0]['source']['userId']
-        msg = json_data['events'][0]['message']['text']
-
-        # ตรวจสอบว่าผู้ใช้พิมพ์ข้อความเฉพาะเพื่อเรียก main_quick_reply
-        if msg.lower() in ["menu", "เมนู", "main", "quick reply"]:  # เพิ่มคำที่ต้องการให้ตอบกลับด้วย quick reply
-            bot_reply = "เลือกหมวดหมู่ที่คุณสนใจ"
-            line_bot_api.reply_message(reply_token, [
-                TextSendMessage(text=bot_reply, quick_reply=main_quick_reply())
-            ])
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        # ตรวจสอบว่าข้อความเป็นคำภาษาไทยและแปลงเป็นหมวดหมู่ภาษาอังกฤษ
-        translated_category = translate_to_english(msg)
-        if translated_category:
-            # สินค้าที่แปลงจากภาษาไทยเป็นภาษาอังกฤษได้ (Shirts, Tote Bag, etc.)
-            products = scrape_converse(translated_category)
-            send_flex_message(reply_token, products)
-            bot_reply = f"แสดงสินค้าสำหรับ {translated_category}"
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        # แยกเคสของ "Sale!!" ออกจากการตรวจสอบ greeting
-        elif msg == "Sale!!":
-            bot_reply = "ยังไม่มีรุ่นไหนลดราคา"
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=bot_reply, quick_reply=main_quick_reply()))
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        # ถามคำแนะนำหรือ Best Selling
-        elif msg.lower() in ["ขอคำแนะนำ", "แนะนำ", "recommend", "best selling"]:
-            send_best_selling_flex_message(reply_token)
-            return 'OK'
-
-        # ตรวจสอบข้อความ greeting ปกติ
-        matched_greeting = compute_similar(msg)
-        if matched_greeting:
-            # Fetch reply for the matched greeting from Neo4j
-            bot_reply = neo4j_search(matched_greeting)
-            line_bot_api.reply_message(reply_token, [
-                TextSendMessage(text=bot_reply),
-                TextSendMessage(text="เลือกหมวดหมู่ หรือ รุ่นที่สนใจ หรือ พิมพ์ แนะนำ เพื่อดูสินค้าขายดีได้ครับ", quick_reply=main_quick_reply())
-            ])
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        # Handle each main category selection (Shoe, Collection, Product)
-        if msg == "Shoe":
-            quick_reply = QuickReply(items=[
-                QuickReplyButton(action=MessageAction(label="RISE COFFEE", text="RISE COFFEE")),
-                QuickReplyButton(action=MessageAction(label="MAISON KEEPS", text="MAISON KEEPS")),
-                QuickReplyButton(action=MessageAction(label="GAT", text="GAT")),
-                QuickReplyButton(action=MessageAction(label="ASTRO", text="ASTRO")),
-                QuickReplyButton(action=MessageAction(label="ALEXIS", text="ALEXIS")),
-                QuickReplyButton(action=MessageAction(label="BUMPER", text="BUMPER")),
-                QuickReplyButton(action=MessageAction(label="COOPER", text="COOPER")),
-                QuickReplyButton(action=MessageAction(label="SLIP ON", text="SLIP ON")),
-                QuickReplyButton(action=MessageAction(label="MACC", text="MACC")),
-                QuickReplyButton(action=MessageAction(label="HI TOP", text="HI TOP"))
-            ])
-            bot_reply = "สนใจรองเท้ารุ่นไหน? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ"
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=bot_reply, quick_reply=quick_reply))
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        elif msg == "Collection":
-            quick_reply = QuickReply(items=[
-                QuickReplyButton(action=MessageAction(label="MAVERICKS", text="MAVERICKS")),
-                QuickReplyButton(action=MessageAction(label="ODYSSEE", text="ODYSSEE")),
-                QuickReplyButton(action=MessageAction(label="MIDNIGHT SUN", text="MIDNIGHT SUN")),
-                QuickReplyButton(action=MessageAction(label="MACC", text="MACC"))
-            ])
-            bot_reply = "สนใจ Collection ไหนครับ? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ"
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=bot_reply, quick_reply=quick_reply))
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        elif msg == "Product":
-            quick_reply = QuickReply(items=[
-                QuickReplyButton(action=MessageAction(label="Shirts", text="Shirts")),
-                QuickReplyButton(action=MessageAction(label="Tote Bag", text="Tote Bag")),
-                QuickReplyButton(action=MessageAction(label="Socks", text="Socks")),
-                QuickReplyButton(action=MessageAction(label="Pants", text="Pants")),
-                QuickReplyButton(action=MessageAction(label="Hats", text="Hats"))
-            ])
-            bot_reply = "สนใจอะไรครับ? หรือพิมพ์ เมนู เพิ่อกลับไปเลือกหมวดหมู่ได้ครับ"
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=bot_reply, quick_reply=quick_reply))
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        elif msg == "General":
-            bot_reply = 'คำถามทั่วไป\n1.ลองสินค้าจริงได้ที่ไหนบ้าง\n2.Mustard Sneakers เป็นแบรนด์ของที่ไหน\n3.รองเท้าทำมาจากวัสดุอะไร\n4.ทำความสะอาดรองเท้าอย่างไร'
-            line_bot_api.reply_message(reply_token, [TextSendMessage(text=bot_reply, quick_reply=general_quick_reply())])
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
-
-        # Handle each numbered FAQ selection
-        elif msg in ["1", "2", "3", "4"]:
-            faqs = scrape_general_faq()  # Scrape the FAQ answers
-            if msg in faqs:
-                bot_reply = faqs[msg]  # Get the corresponding answer
-                line_bot_api.reply_message(reply_token, [
-                    TextSendMessage(text=bot_reply),  # First message: Display the answer
-                    TextSendMessage(
-                        text='คำถามทั่วไป\n1.ลองสินค้าจริงได้ที่ไหนบ้าง\n2.Mustard Sneakers เป็นแบรนด์ของที่ไหน\n3.รองเท้าทำมาจากวัสดุอะไร\n4.ทำความสะอาดรองเท้าอย่างไร', 
-                        quick_reply=general_quick_reply()  # Second message: Show the "General" menu again
-                    )
-                ])
-            else:
-                bot_reply = "ขออภัย ไม่พบคำตอบสำหรับคำถามนี้"
-                line_bot_api.reply_message(reply_token, [
-                    TextSendMessage(text=bot_reply),  # Error message
-                    TextSendMessage(
-                        text='คำถามทั่วไป\n1.ลองสินค้าจริงได้ที่ไหนบ้าง\n2.Mustard Sneakers เป็นแบรนด์ของที่ไหน\n3.รองเท้าทำมาจากวัสดุอะไร\n4.ทำความสะอาดรองเท้าอย่างไร', 
-                        quick_reply=general_quick_reply()  # Second message: Show the "General" menu again
-                    )
-                ])
-            save_chat_history(user_id, msg, bot_reply)
-            return 'OK'
+        events = json_data.get('events', [])
+    except Exception as e:
+        logger.warning("Could not parse the LINE webhook body: %s", e)
+        return 'OK'
 
-        else:
-            # Handle product selections and scrape data
-            products = scrape_converse(msg)
-            send_flex_message(reply_token, products)
-            bot_reply = f"แสดงสินค้าสำหรับ {msg}"
+    accepted = [event_dispatcher.submit(event) for event in events]
+    if not all(accepted):
+        return 'Busy', 503  # Queues are full; LINE redelivers and already-queued events are deduplicated
+    return 'OK'
+
+# Event queue depth, counters, recent per-event latency, which routing tier resolved each message
+# and the embedding cache hit ratio / micro-batch sizes
+@app.route("/stats", methods=['GET'])
+def stats():
+    return {**event_dispatcher.stats(), "intents": dict(router.counters), "matcher_errors": dict(router.matcher_errors),
+            "embeddings": query_cache.stats()}
+
+metrics.describe("event_queue_depth", "LINE events waiting for a worker")
+metrics.describe("event_dispatcher_events", "LINE events seen by the webhook, by outcome")
+metrics.describe("intent_tier_messages", "Messages resolved by each intent routing tier")
+metrics.describe("intent_matcher_errors", "Semantic matcher failures, treated as no match")
+metrics.describe("query_cache_operations", "User-message embedding cache lookups, by result")
+metrics.describe("flex_cache_operations", "Rendered Flex carousel cache lookups, by result")
+metrics.describe("search_cache_operations", "Product search cache lookups, by result")
+metrics.describe("chat_history_records", "Chat history records, by state")
+metrics.describe("chat_retention_summarized", "Chat nodes rolled into daily summaries and deleted by the retention job")
+metrics.describe("chat_history_pending", "Chat history records buffered and not yet written")
+metrics.describe("component_ready", "1 when the component has been initialized")
 
+# Prometheus metrics: stage/event latency histograms plus the counters and gauges of each component
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    def family(values, label):
+        return {((label, key),): value for key, value in values.items() if isinstance(value, (int, float))}
+    gauges = {
+        "event_queue_depth": {(): event_dispatcher.depth()},
+        "event_dispatcher_events": family(event_dispatcher.counters, "outcome"),
+        "intent_tier_messages": family(router.counters, "tier"),
+        "intent_matcher_errors": family(dict(router.matcher_errors), "matcher"),
+        "query_cache_operations": family(query_cache.counters, "result"),
+        "flex_cache_operations": family(flex_renderer.counters, "result"),
+        "search_cache_operations": family(search_cache.stats, "result"),
+        "chat_history_records": family(history_writer.counters, "state"),
+        "chat_history_pending": {(): history_writer.pending()},
+        "chat_retention_summarized": {(): chat_retention.counters["summarized"]},
+        "component_ready": {(("component", name),): int(c.ready) for name, c in components.items()},
+    }
+    return metrics.render(gauges), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# Compare an encoder backend with the fp32 PyTorch model on the greeting corpus: cosine drift of each
+# embedding, top-1 agreement of each greeting's nearest other greeting, top-1 agreement for sample
+# user messages, and encode time for the whole corpus.
+def encoder_parity(backend, texts=None, queries=("สวัสดี", "สวัสดีครับ", "hello", "hi", "ขอบคุณ", "แนะนำ", "ราคาเท่าไหร่")):
+    if texts is None:
+        latest = greeting_index._latest_on_disk()
+        if latest is None:
+            greetings_component.get()
+            latest = greeting_index._state
+        texts = list(latest[1])
+    if len(texts) < 2:
+        raise ValueError("Need at least two greetings to compare")
+
+    report = {"backend": backend, "texts": len(texts)}
+    vectors = {}
+    for name, encoder in (("reference", SentenceEncoder("torch")), ("candidate", SentenceEncoder(backend))):
+        started = time.perf_counter()
+        corpus = encoder.encode(texts)
+        report[f"{name}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        vectors[name] = (corpus, encoder.encode(list(queries)) if queries else None)
+
+    (ref, ref_queries), (cand, cand_queries) = vectors["reference"], vectors["candidate"]
+    drift = 1.0 - np.sum(ref * cand, axis=1)
+    report["drift_mean"] = float(drift.mean())
+    report["drift_max"] = float(drift.max())
+
+    def nearest_other(matrix):
+        similarities = matrix @ matrix.T
+        np.fill_diagonal(similarities, -np.inf)
+        return similarities.argmax(axis=1)
+    report["top1_agreement"] = float(np.mean(nearest_other(ref) == nearest_other(cand)))
+    if queries:
+        agree = (ref_queries @ ref.T).argmax(axis=1) == (cand_queries @ cand.T).argmax(axis=1)
+        report["query_top1_agreement"] = float(agree.mean())
+    return report
+
+# Liveness: the process is up and serving requests
+@app.route("/healthz", methods=['GET'])
+def healthz():
+    return {"status": "ok"}
+
+# Readiness: every required component (model, Neo4j, greetings) is initialized
+@app.route("/readyz", methods=['GET'])
+def readyz():
+    status = {name: c.status() for name, c in components.items()}
+    ready = all(c.ready for c in components.values() if c.required)
+    return {"ready": ready, "components": status}, 200 if ready else 503
+
+# One dummy encode and scrape so the first real message does not pay for cold model and connection pools
+def warm_up():
+    get_encoder().encode("warm up")
+    try:
+        scrape_best_selling()
+        if FETCH_BACKEND == "selenium":
+            browser_pool.warm(1)
     except Exception as e:
-        print(f"Error processing the LINE event: {e}")
+        logger.warning("Startup: warm-up scrape failed: %s", e)
 
-    return 'OK'
+warmup_component = component("warmup", warm_up, required=False)
+
+# Start initializing every component concurrently in the background; returns immediately.
+# Components that depend on others (greetings needs the model and Neo4j) wait for them on first use.
+def init_components(warm=STARTUP_WARMUP):
+    started = time.perf_counter()
+    warmup_component.required = warm  # When warming up, do not report ready until it has run
+    for c in components.values():
+        if c is not warmup_component or warm:
+            c.start()
+
+    def report():
+        for c in components.values():
+            if c.required:
+                c.wait()
+        logger.info("Startup: ready in %.2fs (%s)", time.perf_counter() - started,
+                    ", ".join(f"{c.name} {c.seconds:.2f}s" for c in components.values() if c.ready))
+    threading.Thread(target=report, name="init-report", daemon=True).start()
+
+_app_created = False
+
+# App factory: start the background workers and the concurrent component initialization.
+# The webhook accepts events right away; handlers wait for the components they need.
+def create_app(warm=STARTUP_WARMUP):
+    global _app_created
+    if _app_created:
+        return app
+    _app_created = True
+    configure_logging()
+    event_dispatcher.start()
+    history_writer.start()
+    init_components(warm)
+    greetings.start()
+    faqs.start()
+    if CHAT_RETENTION_INTERVAL:
+        chat_retention.start(catalog_crawler.is_leader, CHAT_RETENTION_INTERVAL)
+    if CATALOG_CRAWL_INTERVAL:
+        catalog_crawler.start()
+    atexit.register(shutdown_app)
+    return app
+
+_app_shut_down = False
+
+# Finish queued events, flush their chat history, then close Chrome (on exit, or when a
+# gunicorn worker is stopped)
+def shutdown_app():
+    global _app_shut_down
+    if _app_shut_down or not _app_created:
+        return
+    _app_shut_down = True
+    event_dispatcher.shutdown()
+    history_writer.close()
+    browser_pool.close()
+
+# Load the read-only state workers can share in a pre-fork master (gunicorn preload_app): the encoder
+# weights and the embedding indexes, which are memory-mapped so their pages are shared anyway.
+# Nothing here starts a thread or opens a connection; create_app() runs in each worker after the fork.
+def preload():
+    configure_logging()
+    started = time.perf_counter()
+    # ONNX Runtime creates its thread pools with the session, and those do not survive a fork
+    if ENCODER_BACKEND != "onnx":
+        # Neither does a GNU OpenMP thread pool: a worker whose main thread enters a parallel region
+        # after the master has run one with several threads hangs. Load (and encode) on one thread in
+        # the master; each worker gets ENCODER_THREADS back right after the fork.
+        worker_threads = ENCODER_THREADS or torch.get_num_threads()
+        os.register_at_fork(after_in_child=lambda: torch.set_num_threads(worker_threads))
+        factory = model_component.factory
+        model_component.factory = lambda: SentenceEncoder(threads=1)
+        try:
+            model_component.get()
+        except Exception as e:
+            # The master keeps serving: each worker retries the load in the background after the fork
+            logger.warning("Preload: model failed (%s), workers will load it themselves", e)
+        finally:
+            model_component.factory = factory
+    for index in (greeting_index, faqs.index, product_search.index):
+        index.load_latest()
+    gc.freeze()  # Keep preloaded objects out of GC passes, which would otherwise copy their pages
+    logger.info("Preload: done in %.2fs", time.perf_counter() - started)
 
 if __name__ == '__main__':
-    app.run(port=5000, debug=True)
+    if sys.argv[1:] == ['compare-backends']:
+        for row in compare_backends():
+            print(json.dumps(row, ensure_ascii=False))
+    elif sys.argv[1:] == ['chat-retention']:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        ensure_neo4j_schema()
+        print(json.dumps({"summarized": chat_retention.run()}))
+    elif sys.argv[1:2] == ['encoder-parity']:
+        print(json.dumps(encoder_parity(sys.argv[2] if len(sys.argv) > 2 else "int8"), ensure_ascii=False))
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        # Development server; in production serve with gunicorn -c gunicorn.conf.py
+        create_app().run(port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,423 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+import fixture_server
+
+# Offline load test for the webhook pipeline. WebScape runs in-process behind a real HTTP server,
+# with local stand-ins for everything it talks to:
+#   - fixture_server.py serves the saved shop pages (SCRAPE_BASE_URL points at it)
+#   - a fake LINE API records replies, so latency is measured from webhook POST to reply received
+#   - a fake Neo4j driver serves a small greeting corpus and accepts chat history writes
+#   - optionally (--encoder fake) a hash-based encoder instead of the SentenceTransformer model
+#
+#   python benchmark.py --requests 200 --concurrency 16
+#   python benchmark.py --scenario faq --scenario menu --encoder torch --crawl
+#   python benchmark.py --payloads recorded.jsonl   # one LINE webhook body per line
+#
+# With --target the deliveries go to an already running server instead (e.g. gunicorn started with
+# LINE_API_ENDPOINT pointing at --line-port); --server-pid then samples the memory of its processes.
+
+SCENARIOS = {
+    "greeting": ["สวัสดี", "hello", "ขอบคุณ", "สวัสดีครับ"],
+    "menu": ["menu", "Shoe", "Collection", "Product", "General", "Sale!!"],
+    "category": ["รองเท้า", "ถุงเท้า", "เสื้อ", "กระเป๋า"],
+    "best_selling": ["แนะนำ", "best selling"],
+    "faq": ["1", "2", "3", "4"],
+    "free_text": ["RISE COFFEE", "MAVERICKS", "ASTRO Black", "canvas sneakers"],
+}
+
+GREETINGS = [
+    ("สวัสดี", "สวัสดีครับ ยินดีต้อนรับสู่ Mustard Sneakers"),
+    ("สวัสดีครับ", "สวัสดีครับ มีอะไรให้ช่วยไหมครับ"),
+    ("hello", "Hello! Welcome to Mustard Sneakers"),
+    ("ขอบคุณ", "ยินดีครับ"),
+]
+
+
+# Deterministic stand-in for SentenceEncoder: unit vectors seeded by the text, so identical texts
+# match exactly and everything else scores near zero
+class FakeEncoder:
+    backend = "fake"
+    id = "fake"
+    dims = 512
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dims).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, batch_size=32):
+        time.sleep(0.002)  # Roughly a tiny forward pass, so encode still shows up in the profile
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dims), np.float32)
+
+
+class FakeResult(list):
+    def consume(self):
+        return None
+
+
+# Minimal Neo4j driver: answers the greeting query and counts writes
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **kwargs):
+        time.sleep(self.driver.latency)
+        if "MATCH (n:Greeting)" in query:
+            return FakeResult({"name": name, "reply": reply} for name, reply in GREETINGS)
+        rows = (parameters or kwargs).get("rows")
+        if rows:  # Chat history batch; schema statements are only acknowledged
+            with self.driver.lock:
+                self.driver.writes += len(rows)
+        return FakeResult()
+
+
+class FakeDriver:
+    def __init__(self, latency=0.001):
+        self.latency = latency
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def verify_connectivity(self):
+        return None
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        return None
+
+
+# Fake LINE Messaging API: records the time each reply token is answered
+class FakeLine:
+    def __init__(self, port=0):
+        self.waiting = {}
+        self.replies = 0
+        self.lock = threading.Lock()
+        handler = self._handler()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def expect(self, reply_token):
+        event = threading.Event()
+        with self.lock:
+            self.waiting[reply_token] = [event, None]
+        return event
+
+    def received_at(self, reply_token):
+        with self.lock:
+            return self.waiting.pop(reply_token)[1]
+
+    def _handler(self):
+        line = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                received = time.perf_counter()
+                token = json.loads(body or b"{}").get("replyToken")
+                with line.lock:
+                    line.replies += 1
+                    waiter = line.waiting.get(token)
+                    if waiter:
+                        waiter[1] = received
+                        waiter[0].set()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def text_event(text, user_id):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": uuid.uuid4().hex,
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "source": {"type": "user", "userId": user_id},
+        "message": {"id": uuid.uuid4().hex[:18], "type": "text", "quoteToken": "", "text": text},
+    }
+
+
+# Resident set size right now (Linux), falling back to the process peak elsewhere
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _proc_children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+# Memory of a server process and its workers: total PSS (shared pages split between the processes
+# that map them, so pages shared copy-on-write are counted once) and the largest single RSS
+def server_memory_mb(pid):
+    pss, rss = 0, []
+    for process in [pid] + _proc_children(pid):
+        values = {}
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and parts[0] in ("Rss:", "Pss:"):
+                        values[parts[0]] = int(parts[1]) / 1024
+        except OSError:
+            continue
+        pss += values.get("Pss:", 0)
+        rss.append(values.get("Rss:", 0))
+    return pss, max(rss, default=0), len(rss) - 1
+
+
+class RssSampler:
+    def __init__(self, measure=current_rss_mb, interval=0.05):
+        self.measure = measure
+        self.interval = interval
+        self.peak = measure()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.measure())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.measure())
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
+
+
+# Send `total` webhook deliveries built by `make_body` with `concurrency` clients and wait for each reply
+def run_scenario(name, make_body, webhook_url, line, total, concurrency, timeout, server_pid=None):
+    latencies, errors, skipped = [], [0], [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = make_body(i)
+        tokens = [event["replyToken"] for event in body["events"]]
+        if not tokens:  # e.g. a recorded follow or postback delivery: nothing to reply to, nothing to time
+            with lock:
+                skipped[0] += 1
+            return
+        waiters = [line.expect(token) for token in tokens]
+        started = time.perf_counter()
+        try:
+            response = session.post(webhook_url, json=body, timeout=timeout)
+            ok = response.status_code == 200 and all(waiter.wait(timeout) for waiter in waiters)
+        except requests.RequestException:
+            ok = False
+        finished = [line.received_at(token) for token in tokens]
+        with lock:
+            if ok and all(finished):
+                latencies.append((max(finished) - started) * 1000)
+            else:
+                errors[0] += 1
+
+    # In-process: this process's RSS. Against a server: its largest process RSS and total PSS
+    if server_pid:
+        samplers = {"peak_rss_mb": RssSampler(lambda: server_memory_mb(server_pid)[1]),
+                    "peak_pss_mb": RssSampler(lambda: server_memory_mb(server_pid)[0])}
+    else:
+        samplers = {"peak_rss_mb": RssSampler()}
+    with contextlib.ExitStack() as stack:
+        for sampler in samplers.values():
+            stack.enter_context(sampler)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+
+    row = {
+        "scenario": name,
+        "requests": total,
+        "errors": errors[0],
+        "skipped": skipped[0],
+        "throughput_rps": round((total - skipped[0]) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None,
+        "mean_ms": round(statistics.fmean(latencies), 1) if latencies else None,
+    }
+    for column, sampler in samplers.items():
+        row[column] = round(sampler.peak, 1)
+    if server_pid:
+        row["workers"] = server_memory_mb(server_pid)[2]
+    return row
+
+
+def synthetic_bodies(messages, users):
+    def make_body(i):
+        return {"destination": "bench", "events": [text_event(messages[i % len(messages)], random.choice(users))]}
+    return make_body
+
+
+# Recorded webhook bodies, with fresh event ids and reply tokens so redelivery checks do not drop them
+def recorded_bodies(path):
+    with open(path, encoding="utf-8") as f:
+        bodies = [json.loads(line) for line in f if line.strip()]
+
+    def make_body(i):
+        body = json.loads(json.dumps(bodies[i % len(bodies)]))
+        for event in body.get("events", []):
+            event["webhookEventId"] = uuid.uuid4().hex
+            event["replyToken"] = uuid.uuid4().hex
+        body["events"] = [e for e in body.get("events", []) if e.get("message", {}).get("type") == "text"]
+        return body
+    return make_body
+
+
+def print_table(rows):
+    columns = [c for c in ("scenario", "requests", "errors", "skipped", "throughput_rps", "p50_ms", "p95_ms", "p99_ms",
+                           "peak_rss_mb", "workers", "peak_pss_mb") if c in rows[0]]
+    widths = [max(len(c), *(len(str(row[c])) for row in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def report(rows, path=None):
+    print_table(rows)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the LINE webhook pipeline")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="scenario to run (repeatable; default all)")
+    parser.add_argument("--payloads", help="JSONL file of recorded webhook bodies, run as the 'recorded' scenario")
+    parser.add_argument("--requests", type=int, default=100, help="webhook deliveries per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--users", type=int, default=50, help="distinct LINE user ids")
+    parser.add_argument("--encoder", default="fake", help="'fake' (hash-based) or an ENCODER_BACKEND such as torch, int8, onnx")
+    parser.add_argument("--site-delay", type=float, default=0.0, help="seconds of latency added by the fixture server")
+    parser.add_argument("--neo4j-latency", type=float, default=0.001, help="seconds per fake Neo4j query")
+    parser.add_argument("--crawl", action="store_true", help="crawl the fixtures into the local catalog first")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each reply")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--target", help="webhook URL of a running server to load instead of an in-process app")
+    parser.add_argument("--line-port", type=int, default=0, help="port of the fake LINE API (set it for --target)")
+    parser.add_argument("--server-pid", type=int, help="with --target: master pid whose processes' memory is sampled")
+    args = parser.parse_args()
+
+    line = FakeLine(args.line_port)
+    users = [f"U{uuid.uuid4().hex}" for _ in range(args.users)]
+    scenarios = [(name, synthetic_bodies(SCENARIOS[name], users)) for name in (args.scenario or SCENARIOS)]
+    if args.payloads:
+        scenarios.append(("recorded", recorded_bodies(args.payloads)))
+    results_path = os.path.abspath(args.json) if args.json else None
+
+    if args.target:
+        print(f"Fake LINE API on {line.url}; the server must run with LINE_API_ENDPOINT={line.url}")
+        rows = [run_scenario(name, make_body, args.target, line, args.requests, args.concurrency, args.timeout,
+                             args.server_pid) for name, make_body in scenarios]
+        report(rows, results_path)
+        return
+
+    site = fixture_server.serve(port=0, delay=args.site_delay)
+    threading.Thread(target=site.serve_forever, daemon=True).start()
+    os.environ["SCRAPE_BASE_URL"] = f"http://127.0.0.1:{site.server_address[1]}"
+    os.environ.setdefault("SCRAPE_BACKEND", "http")
+    os.environ["LINE_API_ENDPOINT"] = line.url
+    if args.encoder != "fake":
+        os.environ["ENCODER_BACKEND"] = args.encoder
+
+    # Indexes, caches and the catalog are created relative to the working directory; keep them apart
+    workdir = tempfile.mkdtemp(prefix="webscape-bench-")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import WebScape
+
+    fake_driver = FakeDriver(args.neo4j_latency)
+    WebScape.neo4j_component.factory = lambda: fake_driver
+    WebScape.chromedriver_component.factory = lambda: None
+    if args.encoder == "fake":
+        WebScape.model_component.factory = FakeEncoder
+    WebScape.CATALOG_CRAWL_INTERVAL = 0
+    WebScape.CHAT_RETENTION_INTERVAL = 0
+
+    app = WebScape.create_app(warm=False)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    started = time.perf_counter()
+    while requests.get(f"{base}/readyz", timeout=5).status_code != 200:
+        if time.perf_counter() - started > 300:
+            sys.exit("WebScape did not become ready within 300s")
+        time.sleep(0.2)
+    print(f"Ready in {time.perf_counter() - started:.2f}s (workdir {workdir})")
+    if args.crawl:
+        WebScape.catalog_crawler.crawl()
+        print(f"Crawled {len(WebScape.catalog)} products into the local catalog")
+
+    rows = [run_scenario(name, make_body, f"{base}/", line, args.requests, args.concurrency, args.timeout)
+            for name, make_body in scenarios]
+    report(rows, results_path)
+
+    server.shutdown()
+    WebScape.shutdown_app()
+    print(f"Chat history rows written to fake Neo4j: {fake_driver.writes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import re
+import time
+import urllib.parse
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Product grid and FAQ extraction shared by every scraper. Only the target subtrees are parsed:
+# a SoupStrainer keeps the product cards (or the FAQ blocks) and the rest of the page is skipped
+# while parsing, with lxml when it is installed.
+#
+#   python extract.py   # parse-time micro-benchmark on the saved pages in fixtures/
+
+try:
+    import lxml  # noqa: F401  Optional; about twice as fast as html.parser
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# While parsing, a strainer sees the raw class attribute ("collapsible-trigger collapsible--auto-height"),
+# not the split class list, so classes are matched as whitespace-separated tokens
+def _has_class(*names):
+    return re.compile(r"(?:^|\s)(?:%s)(?:\s|$)" % "|".join(map(re.escape, names)))
+
+PRODUCT_CARDS = SoupStrainer("div", class_=_has_class("grid-product__content"))
+FAQ_BLOCKS = SoupStrainer(["button", "div"], class_=_has_class("collapsible-trigger", "collapsible-content"))
+
+# srcset candidates are separated by a comma and whitespace (URLs may contain bare commas); each is
+# a URL followed by descriptors such as "540w", "2x" or the theme's extra "720h"
+_SRCSET_SEPARATOR = re.compile(r",\s+")
+_SRCSET_SIZE = re.compile(r"(\d+(?:\.\d+)?)[wx]")
+
+
+# Compact product card; products are kept in caches and indexes in large numbers
+class Product:
+    __slots__ = ("name", "price", "image", "url")
+
+    def __init__(self, name, price, image, url):
+        self.name = name
+        self.price = price
+        self.image = image
+        self.url = url
+
+    def to_dict(self):
+        return {"name": self.name, "price": self.price, "image": self.image, "url": self.url}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data.get("price", ""), data.get("image", ""), data["url"])
+
+    def _key(self):
+        return (self.name, self.price, self.image, self.url)
+
+    def __eq__(self, other):
+        return isinstance(other, Product) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f"Product({self.name!r}, {self.price!r}, {self.image!r}, {self.url!r})"
+
+
+# Largest candidate of a srcset ("a_360x.jpg 360w, a_540x.jpg 540w" -> "a_540x.jpg")
+def largest_from_srcset(srcset):
+    best, best_size = None, -1.0
+    for candidate in _SRCSET_SEPARATOR.split((srcset or "").strip()):
+        tokens = candidate.split()
+        if not tokens:
+            continue
+        sizes = [float(m.group(1)) for m in map(_SRCSET_SIZE.fullmatch, tokens[1:]) if m]
+        size = sizes[0] if sizes else 0.0
+        if size > best_size:
+            best, best_size = tokens[0].rstrip(","), size
+    return best
+
+# Image URL of a lazy-loaded <img>. The lazysizes markup keeps the real image in data-srcset, or in
+# data-src with a {width} placeholder filled from data-widths; src is only a placeholder until the
+# browser swaps it in.
+def image_url(img):
+    src = img.get("src")
+    if src and not src.startswith("data:"):
+        return src
+    url = largest_from_srcset(img.get("data-srcset") or img.get("srcset"))
+    if url:
+        return url
+    url = img.get("data-src")
+    if url and "{width}" in url:
+        widths = [int(w) for w in re.findall(r"\d+", img.get("data-widths") or "")]
+        url = url.replace("{width}", str(max(widths) if widths else 1080))
+    return url
+
+# Product cards (name, price, image, url) from a product grid page, with absolute URLs
+def parse_products(html, base_url, limit=None):
+    soup = BeautifulSoup(html, PARSER, parse_only=PRODUCT_CARDS)
+    products = []
+    for card in soup.find_all("div", class_="grid-product__content", limit=limit):
+        title = card.find("div", class_="grid-product__title--body")
+        price = card.find("div", class_="grid-product__price")
+        # "lazyloaded" is added by the browser's lazysizes script; raw HTML only has "lazyload"
+        image = card.find("img", class_=["lazyloaded", "lazyload"])
+        link = card.find("a", href=True)
+        img_url = image_url(image) if image else None
+        if title and price and img_url and link:
+            products.append(Product(" ".join(title.get_text(" ").split()), " ".join(price.get_text(" ").split()),
+                                    urllib.parse.urljoin(base_url, img_url), urllib.parse.urljoin(base_url, link["href"])))
+    return products
+
+# Every (question, answer) pair of the FAQ page. Each question is a collapsible trigger button whose
+# aria-controls points at the block holding the answer.
+def parse_faq(html):
+    soup = BeautifulSoup(html, PARSER, parse_only=FAQ_BLOCKS)
+    faqs = []
+    for trigger in soup.find_all("button", class_="collapsible-trigger"):
+        target = trigger.get("aria-controls")
+        content = soup.find(id=target) if target else trigger.find_next_sibling("div")
+        inner = content.find("div", class_="collapsible-content__inner--faq") if content else None
+        if inner is None:
+            continue
+        question = " ".join(trigger.get_text(" ").split())
+        answer = "\n".join(" ".join(p.get_text(" ").split()) for p in inner.find_all("p")) or " ".join(inner.get_text(" ").split())
+        if question and answer:
+            faqs.append((question, answer))
+    return faqs
+
+
+# Full-tree html.parser parse, as the scrapers did before, for comparison
+def _parse_full_tree(html, target):
+    soup = BeautifulSoup(html, "html.parser")
+    if target == "faq":
+        return soup.find_all("div", class_="collapsible-content__inner--faq")
+    return soup.find_all("div", class_="grid-product__content")
+
+def micro_benchmark(pages, rounds=200):
+    report = []
+    for path, target in pages:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        targeted = (lambda: parse_faq(html)) if target == "faq" else (lambda: parse_products(html, "https://example.com"))
+        row = {"page": path, "bytes": len(html.encode("utf-8"))}
+        for name, parse in (("full_tree", lambda: _parse_full_tree(html, target)), ("targeted", targeted)):
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                parse()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            row[f"{name}_ms"] = round(timings[len(timings) // 2], 3)
+        row["speedup"] = round(row["full_tree_ms"] / row["targeted_ms"], 2) if row["targeted_ms"] else None
+        report.append(row)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import os
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+    parser = argparse.ArgumentParser(description="Parse-time micro-benchmark on saved pages")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("pages", nargs="*", help="HTML files to parse (default: the fixtures); FAQ pages are detected by name")
+    args = parser.parse_args()
+    paths = args.pages or [os.path.join(fixtures, name) for name in ("search.html", "collections/all.html", "pages/faq.html")]
+    print(f"parser: {PARSER}")
+    for row in micro_benchmark([(p, "faq" if "faq" in os.path.basename(p) else "products") for p in paths], args.rounds):
+        print(json.dumps(row, ensure_ascii=False))
@@ -0,0 +1,62 @@
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import os
+import posixpath
+import time
+import urllib.parse
+
+# Local stand-in for mustardsneakers.com serving saved pages from fixtures/.
+# A request path maps to a file under fixtures/ with ".html" appended when it has no extension:
+#   /search              -> fixtures/search.html
+#   /search/suggest.json -> fixtures/search/suggest.json
+#   /collections/all     -> fixtures/collections/all.html
+#   /pages/faq           -> fixtures/pages/faq.html
+# Query strings are ignored. Run the bot against it with SCRAPE_BASE_URL=http://127.0.0.1:8765
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    delay = 0.0  # Artificial latency in seconds, to mimic the real site
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        ".html": "text/html; charset=utf-8",
+        ".json": "application/json; charset=utf-8",
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURE_DIR, **kwargs)
+
+    def translate_path(self, path):
+        path = posixpath.normpath(urllib.parse.unquote(urllib.parse.urlsplit(path).path)).strip("/")
+        if not path or path == ".":
+            path = "index"
+        if not posixpath.splitext(path)[1]:
+            path += ".html"
+        return os.path.join(FIXTURE_DIR, *path.split("/"))
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8765, delay=0.0):
+    FixtureHandler.delay = delay
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve saved shop pages for offline scraping")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds of latency added to each response")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.delay)
+    print(f"Serving {FIXTURE_DIR} on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+
+# Production serving:  gunicorn -c gunicorn.conf.py
+#
+# The master imports WebScape and preloads the encoder and the embedding indexes once (preload_app);
+# the forked workers share those pages copy-on-write. Each worker then starts its own event workers,
+# chat history writer, Neo4j driver and refreshers in post_fork, since threads and connections do
+# not survive a fork. On SIGTERM a worker stops accepting requests, finishes the in-flight ones, then
+# drains its queued events and flushes their chat history before exiting.
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))  # The webhook only queues events, so a few threads suffice
+wsgi_app = "WebScape:app"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+timeout = 60
+# Long enough for EVENT_DRAIN_TIMEOUT plus HISTORY_DRAIN_TIMEOUT after the last request
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 70))
+
+# Split the cores between workers so their inference thread pools do not oversubscribe the CPU.
+# Set before WebScape is imported, which reads it.
+os.environ.setdefault("ENCODER_THREADS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def when_ready(server):
+    if preload_app:
+        import WebScape
+        WebScape.preload()
+
+
+def post_fork(server, worker):
+    import WebScape
+    WebScape.create_app()
+
+
+def worker_exit(server, worker):
+    import WebScape
+    WebScape.shutdown_app()
@@ -0,0 +1,87 @@
+import os
+
+from bs4 import BeautifulSoup
+
+import extract
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def read_fixture(path):
+    with open(os.path.join(FIXTURES, path), encoding="utf-8") as f:
+        return f.read()
+
+
+def image_url(markup):
+    return extract.image_url(BeautifulSoup(markup, "html.parser").img)
+
+
+def test_largest_from_srcset_width_descriptors():
+    srcset = "//cdn.test/a_360x.jpg?v=1 360w, //cdn.test/a_540x.jpg?v=1 540w"
+    assert extract.largest_from_srcset(srcset) == "//cdn.test/a_540x.jpg?v=1"
+
+
+def test_largest_from_srcset_ignores_height_descriptors():
+    # Archetype/Impulse themes add a height after the width
+    srcset = ("//cdn.test/a.jpg?v=1&width=180 180w 240h, //cdn.test/a.jpg?v=1&width=360 360w 480h, "
+              "//cdn.test/a.jpg?v=1&width=270 270w 360h")
+    assert extract.largest_from_srcset(srcset) == "//cdn.test/a.jpg?v=1&width=360"
+
+
+def test_largest_from_srcset_keeps_commas_inside_urls():
+    assert extract.largest_from_srcset("//cdn.test/a.jpg?crop=0,0,540,720") == "//cdn.test/a.jpg?crop=0,0,540,720"
+
+
+def test_largest_from_srcset_whitespace_and_density():
+    assert extract.largest_from_srcset("\n   a.jpg 1x,\n   b.jpg 2x\n ") == "b.jpg"
+    assert extract.largest_from_srcset("") is None
+
+
+def test_image_url_prefers_real_src_over_placeholder():
+    assert image_url('<img src="//cdn.test/a.jpg">') == "//cdn.test/a.jpg"
+    assert image_url('<img src="data:image/gif;base64,R0lGOD" data-srcset="//cdn.test/b.jpg 360w">') == "//cdn.test/b.jpg"
+
+
+def test_image_url_fills_width_placeholder():
+    markup = '<img class="lazyload" data-src="//cdn.test/a_{width}x.jpg" data-widths="[180, 360, 540]">'
+    assert image_url(markup) == "//cdn.test/a_540x.jpg"
+
+
+def test_parse_products_fixture():
+    products = extract.parse_products(read_fixture("collections/all.html"), "https://mustardsneakers.com")
+    assert len(products) == 12
+    first = products[0]
+    assert first.name == "Mustard Sneakers RISE COFFEE"
+    assert first.price == "฿2,590"
+    assert first.image == "https://mustardsneakers.com/cdn/shop/products/rise-coffee_540x.jpg?v=1"
+    assert first.url == "https://mustardsneakers.com/products/rise-coffee"
+    assert all(p.image.startswith("https://") and p.url.startswith("https://") for p in products)
+
+
+def test_parse_products_limit():
+    assert len(extract.parse_products(read_fixture("collections/all.html"), "https://mustardsneakers.com", limit=8)) == 8
+
+
+def test_product_round_trip():
+    product = extract.Product("A", "฿1", "https://x/a.jpg", "https://x/a")
+    assert extract.Product.from_dict(product.to_dict()) == product
+    assert not hasattr(product, "__dict__")
+
+
+def test_parse_faq_fixture():
+    faqs = extract.parse_faq(read_fixture("pages/faq.html"))
+    assert len(faqs) == 10
+    assert faqs[0] == ("สั่งซื้อสินค้าอย่างไร", "เลือกสินค้าที่ต้องการ กดเพิ่มลงตะกร้า แล้วชำระเงินได้ทันทีผ่านหน้าเว็บไซต์")
+    questions = [question for question, _ in faqs]
+    for question in ("ลองสินค้าจริงได้ที่ไหนบ้าง", "Mustard Sneakers เป็นแบรนด์ของที่ไหน",
+                     "รองเท้าทำมาจากวัสดุอะไร", "ทำความสะอาดรองเท้าอย่างไร"):
+        assert question in questions
+
+
+def test_parse_products_card_with_extra_classes():
+    html = ('<div class="grid-product__content grid-product__content--sold-out"><a href="/products/a">'
+            '<img class="grid-product__image lazyload" data-srcset="//cdn.test/a_360x.jpg 360w">'
+            '<div class="grid-product__title grid-product__title--body">A</div>'
+            '<div class="grid-product__price">฿1</div></a></div>')
+    products = extract.parse_products(html, "https://mustardsneakers.com")
+    assert products == [extract.Product("A", "฿1", "https://cdn.test/a_360x.jpg", "https://mustardsneakers.com/products/a")]